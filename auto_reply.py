@@ -0,0 +1,164 @@
+import logging
+import re
+from collections import deque
+from config import AUTO_REPLY_REGEX_MAX_LENGTH, AUTO_REPLY_REGEX_MAX_INPUT
+
+try:
+    from re import _parser as _sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse as _sre_parse
+
+logger = logging.getLogger(__name__)
+
+# 自动回复规则的匹配方式
+MATCH_CONTAINS = 'contains'  # 包含关键词即触发
+MATCH_WORD = 'word'  # 关键词需为完整单词
+MATCH_REGEX = 'regex'  # 正则表达式
+MATCH_TYPES = (MATCH_CONTAINS, MATCH_WORD, MATCH_REGEX)
+
+
+_REPEATS = tuple(getattr(_sre_parse, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+                 if hasattr(_sre_parse, name))
+# 正则中各个可变重复的取值个数之积的上限：最多一个不限次数的重复，再加一个可选部分。
+# 例如 a*a*b 在 n 个字符上要回溯 O(n^3) 次，超过这个上限会被拒绝
+_MAX_BACKTRACK = 2 * (AUTO_REPLY_REGEX_MAX_INPUT + 1)
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == '_'
+
+
+def _check_repeats(items, repeated: bool) -> int:
+    """重复的部分里不能再有重复或分支，例如 (a+)+、(a|aa)*，这类写法会导致灾难性回溯
+
+    返回各个可变重复的取值个数之积（分支取各分支之和），即每个起始位置最多回溯的次数，
+    不限次数的重复按 AUTO_REPLY_REGEX_MAX_INPUT 计算
+    """
+    choices = 1
+    for op, av in items:
+        if op in _REPEATS:
+            low, high, sub = av
+            if repeated and high > 1:
+                raise ValueError("Nested quantifiers are not allowed")
+            choices *= _check_repeats(sub, repeated or high > 1)
+            if high == _sre_parse.MAXREPEAT:
+                choices *= AUTO_REPLY_REGEX_MAX_INPUT + 1
+            else:
+                choices *= min(high - low, AUTO_REPLY_REGEX_MAX_INPUT) + 1
+        elif op is _sre_parse.SUBPATTERN:
+            choices *= _check_repeats(av[-1], repeated)
+        elif op is _sre_parse.BRANCH:
+            if repeated:
+                raise ValueError("Alternation inside a repeated group is not allowed")
+            choices *= sum(_check_repeats(branch, repeated) for branch in av[1])
+        elif op in (_sre_parse.ASSERT, _sre_parse.ASSERT_NOT):
+            choices *= _check_repeats(av[1], repeated)
+        elif op in (_sre_parse.GROUPREF, _sre_parse.GROUPREF_EXISTS):
+            raise ValueError("Backreferences are not allowed")
+    return choices
+
+
+def compile_regex(pattern: str):
+    """检查并编译正则规则，不安全或无效的规则抛出 ValueError
+
+    正则在事件循环中对每条消息同步执行，限制长度，拒绝嵌套重复和多个相邻的不限次数重复，
+    保证匹配时间最多是输入长度的平方级，避免一条规则拖住所有聊天室。
+    """
+    if len(pattern) > AUTO_REPLY_REGEX_MAX_LENGTH:
+        raise ValueError(f"Pattern is longer than {AUTO_REPLY_REGEX_MAX_LENGTH} characters")
+    try:
+        if _check_repeats(_sre_parse.parse(pattern), False) > _MAX_BACKTRACK:
+            raise ValueError("Too many variable-length quantifiers")
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern: {e}") from None
+
+
+class AutoReplyMatcher:
+    """自动回复匹配器
+
+    普通关键词和整词关键词编译进同一个 Aho–Corasick 自动机，一次扫描即可找出所有命中；
+    正则规则单独编译。多条规则同时命中时，优先取在消息中出现位置最靠前的，
+    位置相同时取先添加的规则。所有位置都以转成小写后的消息为准。
+    """
+
+    def __init__(self, rules: dict):
+        self._goto = [{}]  # 节点 -> {字符: 子节点}
+        self._fail = [0]
+        self._output = [[]]  # 节点 -> 在此结束的关键词列表
+        self._regexes = []  # (编译后的正则, 关键词)
+        self._whole_word = set()
+        self._order = {}  # 关键词 -> 规则添加的顺序
+
+        for keyword, rule in rules.items():
+            self._order[keyword] = len(self._order)
+            match_type = rule.get('match_type', MATCH_CONTAINS)
+            if match_type == MATCH_REGEX:
+                try:
+                    self._regexes.append((compile_regex(keyword), keyword))
+                except ValueError as e:
+                    logger.warning(f"Skipping auto reply rule {keyword!r}: {e}")
+                continue
+            if not keyword:
+                continue
+            if match_type == MATCH_WORD:
+                self._whole_word.add(keyword)
+            self._insert(keyword)
+        self._build_fail_links()
+
+    def _insert(self, keyword: str):
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append(keyword)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def _is_whole_word(self, text: str, start: int, end: int) -> bool:
+        return ((start == 0 or not _is_word_char(text[start - 1])) and
+                (end == len(text) or not _is_word_char(text[end])))
+
+    def match(self, text: str):
+        """返回命中的关键词，没有命中返回 None"""
+        best = None  # (起始位置, 规则顺序, 关键词)
+        # str.lower() 可能改变非 ASCII 文本的长度，所以正则也在小写后的文本上匹配，位置才可比较
+        lowered = text.lower()
+        node = 0
+        for i, ch in enumerate(lowered):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for keyword in self._output[node]:
+                start = i - len(keyword) + 1
+                if keyword in self._whole_word and not self._is_whole_word(lowered, start, i + 1):
+                    continue
+                candidate = (start, self._order[keyword], keyword)
+                if best is None or candidate < best:
+                    best = candidate
+
+        head = lowered[:AUTO_REPLY_REGEX_MAX_INPUT]
+        for regex, keyword in self._regexes:
+            found = regex.search(head)
+            if found:
+                candidate = (found.start(), self._order[keyword], keyword)
+                if best is None or candidate < best:
+                    best = candidate
+
+        return best[2] if best else None
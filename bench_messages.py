@@ -0,0 +1,57 @@
+"""消息记录内存占用基准测试
+
+对比旧的每条消息一个 dict 与 MessageRecord 在 10 万条消息时的内存占用：
+
+    python bench_messages.py [消息数量]
+"""
+import sys
+import tracemalloc
+from datetime import datetime
+from chat_room import ChatRoom
+
+MESSAGE_TYPES = ['text', 'photo', 'video', 'document', 'voice', 'sticker', 'animation']
+
+
+def build_dicts(count: int) -> list:
+    """旧实现：每条消息一个 dict 加一个 datetime"""
+    messages = []
+    for i in range(count):
+        messages.append({
+            'message_id': i + 1,
+            'user_id': i % 50,
+            'type': MESSAGE_TYPES[i % len(MESSAGE_TYPES)],
+            'content': f"消息 {i}",
+            'timestamp': datetime.now()
+        })
+    return messages
+
+
+def build_room(count: int) -> ChatRoom:
+    """新实现：ChatRoom.add_message 生成 MessageRecord"""
+    room = ChatRoom('bench', 1)
+    for i in range(count):
+        room.add_message(i % 50, MESSAGE_TYPES[i % len(MESSAGE_TYPES)], f"消息 {i}")
+    return room
+
+
+def measure(build, count: int) -> int:
+    tracemalloc.start()
+    result = build(count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    dict_size = measure(build_dicts, count)
+    record_size = measure(build_room, count)
+    print(f"messages:      {count}")
+    print(f"dict:          {dict_size / 1024 / 1024:.1f} MB ({dict_size / count:.0f} B/msg)")
+    print(f"MessageRecord: {record_size / 1024 / 1024:.1f} MB ({record_size / count:.0f} B/msg)")
+    print(f"saved:         {(1 - record_size / dict_size) * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,35 @@
 from telegram.ext import (
-    Updater, CommandHandler, MessageHandler as TelegramMessageHandler,
-    Filters
+    Application, CommandHandler, MessageHandler as TelegramMessageHandler,
+    filters
 )
+from telegram.request import HTTPXRequest
 from message_handler import MessageHandler as CustomMessageHandler
-from telegram import ParseMode
+from telegram.constants import ParseMode
 import logging
 import os
-import qrcode
 from datetime import datetime, timedelta
 import uuid
 from chat_room import ChatRoom
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import glob
 import functools
 from config import *
 from user_manager import UserManager
+from storage import create_storage
+from message_log import MessageLog
+from cleanup import RoomCleaner
+from media_store import MediaStore
+from outbox import Outbox
+from qr_service import QRService
+from exporter import ChatExporter
+from moderation import ModerationEngine
+from mime_sniff import configure_http_client, close_http_client
+from webhook import run_webhook
 import json
-from io import BytesIO
 import time
-from languages import get_text, LANGUAGES
+from languages import get_text, LANGUAGES, catalog
 from config import BOT_TOKEN, BOT_USERNAME
 import pytz
-import base64
-import ssl
-import certifi
 
 # 配置日志
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -33,6 +39,36 @@ logger = logging.getLogger(__name__)
 # 存储聊天室信息
 chat_rooms = {}
 user_manager = UserManager()
+media_store = MediaStore()
+room_cleaner = RoomCleaner(chat_rooms, user_manager, media_store=media_store)
+ChatRoom.expiry_hooks.append(room_cleaner.track)
+qr_service = QRService()
+room_cleaner.release_hooks.append(qr_service.evict_room)
+exporter = ChatExporter()
+room_cleaner.release_hooks.append(exporter.remove_room_exports)
+
+def load_state(storage):
+    """从存储中恢复未过期的聊天室和用户数据"""
+    user_manager.load(storage)
+    for state in storage.load_rooms():
+        room_id = state['room_id']
+        if not state['is_active'] or datetime.now() > state['expire_time']:
+            storage.delete_room(room_id)
+            MessageLog.remove_files(room_id)
+            qr_service.evict_room(room_id)
+            exporter.remove_room_exports(room_id)
+            continue
+        chat_rooms[room_id] = ChatRoom.from_state(state, storage, user_manager.membership)
+    # 用户数据中可能还引用着已关闭的聊天室
+    for room_id in set(user_manager.membership.room_ids()) | set(user_manager.room_creators):
+        if room_id not in chat_rooms:
+            user_manager.remove_room(room_id)
+    logger.info(f"Loaded {len(chat_rooms)} rooms from storage")
+
+async def cleanup_job():
+    """定时清理过期聊天室和过期的导出文件（在事件循环中运行，不与消息处理并发修改聊天室）"""
+    room_cleaner.sweep()
+    exporter.sweep()
 
 def main():
     """主函数"""
@@ -40,90 +76,139 @@ def main():
     logger.info("Starting bot...")
     
     try:
+        # 恢复持久化数据
+        storage = create_storage()
+        load_state(storage)
+        catalog.reload_if_changed()
+        
         # 配置代理
         server = "120.241.144.225"
         port = 10575
-        secret = "eedb2dcbee75faa6f5bf10dda691437828617a7572652e6d6963726f736f66742e636f6d"
+        proxy_url = f'https://{server}:{port}'
+        connect_timeout = 60.0
+        read_timeout = 60.0
         
-        # 解码secret
-        secret_bytes = bytes.fromhex(secret)
-        domain = "microsoft.com"
-        secret_with_domain = secret_bytes + domain.encode()
-        encoded_secret = base64.b64encode(secret_with_domain).decode()
+        # 所有 Bot API 调用共用一个连接池，广播和下载可以在同一个事件循环里并发
+        request = HTTPXRequest(
+            connection_pool_size=CONNECTION_POOL_SIZE,
+            proxy_url=proxy_url,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout
+        )
+        # 长轮询单独使用一个连接，避免占用发送消息的连接
+        get_updates_request = HTTPXRequest(
+            proxy_url=proxy_url,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout
+        )
+        # 媒体下载走同样的代理，使用同样的超时和连接数
+        configure_http_client(proxy_url, connect_timeout, read_timeout, CONNECTION_POOL_SIZE)
         
-        # 配置SSL上下文
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        ssl_context.verify_mode = ssl.CERT_REQUIRED
-        ssl_context.check_hostname = True
+        scheduler = AsyncIOScheduler()
+        # 出站消息队列，未发送完的消息重启后继续发送
+        outbox = Outbox(chat_rooms, storage)
+        # 批量封禁/禁言
+        moderation = ModerationEngine(chat_rooms, user_manager, outbox)
+
+        def parse_user_ids(args) -> list:
+            return [int(arg) for arg in args if arg.lstrip('-').isdigit()]
+
+        async def ban_command(update, context):
+            """/ban 用户ID... ：机器人管理员在所有聊天室封禁用户"""
+            if update.effective_user.id not in BOT_ADMINS:
+                await update.message.reply_text("只有机器人管理员可以使用此命令")
+                return
+            user_ids = parse_user_ids(context.args)
+            if not user_ids:
+                await update.message.reply_text("用法：/ban 用户ID [用户ID ...]")
+                return
+            report = moderation.ban_users(user_ids)
+            await update.message.reply_text(
+                f"已封禁 {report['users']} 个用户，移出 {report['evicted']} 个聊天室成员，"
+                f"取消 {report['cancelled']} 条待发送消息")
+
+        async def mute_command(update, context):
+            """/mute 用户ID... ：聊天室管理员在当前聊天室禁言用户"""
+            room = chat_rooms.get(context.user_data.get('current_room'))
+            if room is None:
+                await update.message.reply_text("请先加入聊天室！")
+                return
+            if not room.is_admin(update.effective_user.id):
+                await update.message.reply_text("只有聊天室管理员可以使用此命令")
+                return
+            user_ids = parse_user_ids(context.args)
+            if not user_ids:
+                await update.message.reply_text("用法：/mute 用户ID [用户ID ...]")
+                return
+            report = moderation.mute_users(user_ids, [room.room_id])
+            await update.message.reply_text(f"已在当前聊天室禁言 {report['muted']} 个用户")
         
-        # 配置代理
-        request_kwargs = {
-            'proxy_url': f'https://{server}:{port}',
-            'urllib3_proxy_kwargs': {
-                'ssl_context': ssl_context,
-                'assert_hostname': domain,
-                'headers': {
-                    'X-MTProto-Secret': encoded_secret,
-                    'Host': domain
-                }
-            },
-            'connect_timeout': 60.0,
-            'read_timeout': 60.0,
-            'bootstrap_retries': 5,
-            'connect_retries': 5,
-            'read_retries': 5
-        }
+        async def post_init(application):
+            """事件循环启动后再启动调度器和出站队列"""
+            scheduler.add_job(cleanup_job, 'interval', minutes=CLEANUP_INTERVAL)
+            scheduler.add_job(catalog.reload_if_changed, 'interval', seconds=LOCALES_RELOAD_INTERVAL)
+            scheduler.start()
+            outbox.start(application.bot)
+            logger.info("Bot is running!")
+            
+        async def post_shutdown(application):
+            """停止时关闭调度器、出站队列、下载连接池、二维码进程池和存储"""
+            scheduler.shutdown(wait=False)
+            await outbox.stop()
+            await close_http_client()
+            qr_service.close()
+            storage.close()
         
-        # 创建updater
-        updater = Updater(
-            token=BOT_TOKEN,
-            use_context=True,
-            request_kwargs=request_kwargs,
-            workers=4,
-            base_url='https://api.telegram.org/bot'
+        # 创建 application
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .base_url('https://api.telegram.org/bot')
+            .request(request)
+            .get_updates_request(get_updates_request)
+            .concurrent_updates(True)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
         )
-        logger.info("Bot updater created successfully")
-
-        dp = updater.dispatcher
+        logger.info("Bot application created successfully")
         logger.info("Setting up command handlers...")
 
         # 创建消息处理器
-        message_handler = CustomMessageHandler(chat_rooms)
+        message_handler = CustomMessageHandler(chat_rooms, outbox=outbox, media_store=media_store)
 
         # 添加命令处理器
-        dp.add_handler(CommandHandler("start", start))
-        dp.add_handler(CommandHandler("new_chat", new_chat))
-        dp.add_handler(CommandHandler("help", help_command))
-        dp.add_handler(CommandHandler("leave", leave_chat))
-        dp.add_handler(CommandHandler("close", close_chat))
+        application.add_handler(CommandHandler("start", start))
+        application.add_handler(CommandHandler("new_chat", new_chat))
+        application.add_handler(CommandHandler("help", help_command))
+        application.add_handler(CommandHandler("leave", leave_chat))
+        application.add_handler(CommandHandler("close", close_chat))
+        application.add_handler(CommandHandler("ban", ban_command))
+        application.add_handler(CommandHandler("mute", mute_command))
         logger.info("Command handlers registered")
 
         # 添加消息处理器
-        dp.add_handler(TelegramMessageHandler(
-            Filters.text & ~Filters.command,
+        application.add_handler(TelegramMessageHandler(
+            (filters.TEXT & ~filters.COMMAND) | filters.PHOTO | filters.VIDEO |
+            filters.Document.ALL | filters.VOICE | filters.Sticker.ALL | filters.ANIMATION,
             message_handler.handle_message
         ))
         logger.info("Message handler registered")
 
         # 添加错误处理器
-        dp.add_error_handler(error_callback)
+        application.add_error_handler(error_callback)
         logger.info("Error handler registered")
 
-        # 启动机器人
-        logger.info("Starting polling...")
-        updater.start_polling(
-            timeout=30,
-            read_latency=2.0,
-            drop_pending_updates=True
-        )
-        
-        # 启动调度器
-        scheduler = BackgroundScheduler()
-        scheduler.start()
-        logger.info("Bot is running!")
-        
-        # 保持运行
-        updater.idle()
+        # 启动机器人，会一直运行到收到停止信号
+        if USE_WEBHOOK:
+            logger.info("Starting webhook...")
+            run_webhook(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_URL)
+        else:
+            logger.info("Starting polling...")
+            application.run_polling(
+                timeout=30,
+                drop_pending_updates=True
+            )
         
     except Exception as e:
         logger.error(f"Error in main function: {e}")
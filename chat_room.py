@@ -1,12 +1,27 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import time
+from config import MAX_USERS_PER_ROOM, DELIVERY_STATE_SIZE, SEARCH_PAGE_SIZE
+from message_store import MessageStore, MessageRecord
+from message_log import MessageLog
+from name_cache import name_cache
+from search_index import SearchIndex, message_text
+from room_stats import RoomStats
+from presence import PresenceTracker
+from membership import membership, MembershipIndex
+from auto_reply import AutoReplyMatcher, compile_regex, MATCH_CONTAINS, MATCH_REGEX, MATCH_TYPES
 
 class ChatRoom:
-    def __init__(self, room_id, creator_id):
+    expiry_hooks = []  # 过期时间设置或变化后调用 hook(room)，RoomCleaner.track 登记在这里
+
+    def __init__(self, room_id, creator_id, storage=None, membership_index: MembershipIndex = None):
         self.room_id = room_id
         self.creator_id = creator_id
-        self.messages = []
-        self.users = set()
+        # 持久化的聊天室把消息写入磁盘日志，内存中只保留最近的部分
+        self.messages = MessageStore(MessageLog(room_id) if storage is not None else None)
+        self._search_index = None  # 消息全文索引，第一次搜索时建立，之后随消息增量更新
+        self._stats = RoomStats()  # 消息统计计数，随消息增量更新
+        self.membership = membership_index or membership  # 成员关系保存在与 UserManager 共享的双向索引中
         self.created_at = datetime.now()
         self.is_active = True
         self.expire_time = datetime.now() + timedelta(hours=24)  # 24小时后自动过期
@@ -18,34 +33,116 @@ class ChatRoom:
         self.edited_messages = {}  # 消息编辑历史
         self.max_pinned = 3  # 最大置顶消息数量
         self.auto_replies = {}  # 自动回复规则
+        self._auto_reply_matcher = None  # 自动回复匹配器，规则变化后重新编译
         self.message_templates = {}  # 消息模板
-        self.online_users = {}  # 在线用户列表
-        self.online_timeout = 1800  # 在线用户超时时间，30分钟
+        self.text_batching = False  # 是否合并短时间内的连续文本消息再发送
+        self.delivery_states = OrderedDict()  # 最近消息的投递状态 message_id -> {user_id: 状态}
+        self.presence = PresenceTracker()  # 在线状态，超时时间为 config.ONLINE_TIMEOUT
+        self.storage = storage  # 持久化存储后端，为 None 时只保存在内存中
+        self._save()
+        self._notify_expiry()
+        
+    def to_state(self) -> dict:
+        """导出聊天室状态（不含消息），用于持久化"""
+        return {
+            'room_id': self.room_id,
+            'creator_id': self.creator_id,
+            'users': set(self.users),
+            'created_at': self.created_at,
+            'is_active': self.is_active,
+            'expire_time': self.expire_time,
+            'banned_users': set(self.banned_users),
+            'admins': set(self.admins),
+            'max_users': self.max_users,
+            'password': self.password,
+            'pinned_messages': list(self.pinned_messages),
+            'edited_messages': [[message_id, list(history)]
+                                for message_id, history in self.edited_messages.items()],
+            'auto_replies': {keyword: dict(rule) for keyword, rule in self.auto_replies.items()},
+            'message_templates': {name: dict(t) for name, t in self.message_templates.items()},
+            'text_batching': self.text_batching,
+            'announcement': getattr(self, 'announcement', None),
+            'announcement_time': getattr(self, 'announcement_time', None),
+            'last_message_id': self.messages.last_id
+        }
+        
+    @classmethod
+    def from_state(cls, state: dict, storage=None, membership_index: MembershipIndex = None):
+        """从持久化状态恢复聊天室，消息从聊天室的消息日志中恢复"""
+        room = cls(state['room_id'], state['creator_id'], membership_index=membership_index)
+        # 以聊天室保存的成员为准，覆盖用户数据中可能过时的记录
+        room.membership.remove_room(room.room_id)
+        for user_id in state['users']:
+            room.membership.add(user_id, room.room_id)
+        room.created_at = state['created_at']
+        room.is_active = state['is_active']
+        room.expire_time = state['expire_time']
+        room._notify_expiry()
+        room.banned_users = set(state['banned_users'])
+        room.admins = set(state['admins'])
+        room.max_users = state['max_users']
+        room.password = state['password']
+        room.pinned_messages = list(state['pinned_messages'])
+        room.edited_messages = {message_id: history
+                                for message_id, history in state['edited_messages']}
+        room.auto_replies = state['auto_replies']
+        room.message_templates = state['message_templates']
+        room.text_batching = state.get('text_batching', False)
+        if state.get('announcement'):
+            room.announcement = state['announcement']
+            room.announcement_time = state['announcement_time']
+        if storage is not None:
+            room.messages = MessageStore(MessageLog(room.room_id))
+            room._stats = None  # 已有的消息在第一次查询统计时计入
+        room.messages.advance_id(state['last_message_id'])
+        room.storage = storage
+        return room
+        
+    def _notify_expiry(self):
+        for hook in self.expiry_hooks:
+            hook(self)
+
+    def _save(self):
+        """保存聊天室状态"""
+        if self.storage is not None:
+            self.storage.save_room(self.room_id, self.to_state())
         
     def add_message(self, user_id, message_type, content):
         """添加消息到聊天室"""
-        message = {
-            'message_id': len(self.messages) + 1,
-            'user_id': user_id,
-            'type': message_type,
-            'content': content,
-            'timestamp': datetime.now()
-        }
+        message = MessageRecord(self.messages.next_id(), user_id, message_type, content)
         self.messages.append(message)
+        if self._stats is not None:
+            self._stats.add(message)
+        if self._search_index is not None:
+            self._search_index.add(message.message_id, message_text(message))
+        return message
+        
+    @property
+    def users(self):
+        """聊天室成员（只读，通过 add_user/remove_user 修改）"""
+        return self.membership.users_of(self.room_id)
         
     def add_user(self, user_id):
         """添加用户到聊天室"""
-        self.users.add(user_id)
+        self.membership.add(user_id, self.room_id)
+        self._save()
         
     def remove_user(self, user_id):
         """从聊天室移除用户"""
-        self.users.remove(user_id)
+        if not self.membership.remove(user_id, self.room_id):
+            raise KeyError(user_id)
+        self.presence.discard(user_id)
+        self._save()
         
     def close_room(self):
         """关闭聊天室"""
         self.is_active = False
         self.messages.clear()
-        self.users.clear()
+        self._search_index = None
+        self._stats = RoomStats()
+        self.membership.remove_room(self.room_id)
+        if self.storage is not None:
+            self.storage.delete_room(self.room_id)
         
     def is_expired(self):
         """检查聊天室是否过期"""
@@ -58,6 +155,7 @@ class ChatRoom:
     def set_password(self, password: str):
         """设置聊天室密码"""
         self.password = password
+        self._save()
         
     def check_password(self, password: str) -> bool:
         """检查密码是否正确"""
@@ -66,11 +164,13 @@ class ChatRoom:
     def add_admin(self, user_id: int):
         """添加管理员"""
         self.admins.add(user_id)
+        self._save()
         
     def remove_admin(self, user_id: int):
         """移除管理员"""
         if user_id != self.creator_id:  # 创建者不能被移除管理员权限
             self.admins.discard(user_id)
+            self._save()
             
     def ban_user(self, user_id: int):
         """将用户加入黑名单"""
@@ -78,10 +178,19 @@ class ChatRoom:
             self.banned_users.add(user_id)
             if user_id in self.users:
                 self.remove_user(user_id)
+            else:
+                self._save()
+                
+    def mute_user(self, user_id: int):
+        """禁言用户，保留成员身份"""
+        if user_id != self.creator_id:
+            self.banned_users.add(user_id)
+            self._save()
                 
     def unban_user(self, user_id: int):
         """将用户从黑名单中移除"""
         self.banned_users.discard(user_id)
+        self._save()
         
     def can_join(self, user_id: int) -> bool:
         """检查用户是否可以加入聊天室"""
@@ -90,12 +199,25 @@ class ChatRoom:
         
     def get_user_name(self, user_id: int) -> str:
         """获取用户昵称"""
-        # 这里需要实现从 Telegram 获取用户信息的逻辑
-        return f"用户 {user_id}"
+        return name_cache.get(user_id) or f"用户 {user_id}"
         
     def get_message_history(self, limit: int = 50) -> list:
         """获取聊天记录"""
-        return self.messages[-limit:]
+        return self.messages.recent(limit)
+        
+    def search_messages(self, query: str, page: int = 1, page_size: int = SEARCH_PAGE_SIZE) -> dict:
+        """搜索聊天记录，按相关度分页返回"""
+        if self._search_index is None:
+            self._search_index = SearchIndex()
+            for message in self.messages:
+                self._search_index.add(message.message_id, message_text(message))
+        total, message_ids = self._search_index.search(query, page, page_size)
+        return {
+            'total': total,
+            'page': page,
+            'pages': (total + page_size - 1) // page_size,
+            'messages': [self.messages.get(message_id) for message_id in message_ids]
+        }
         
     def get_online_users(self) -> set:
         """获取在线用户"""
@@ -104,7 +226,7 @@ class ChatRoom:
     def get_room_stats(self) -> dict:
         """获取聊天室统计信息"""
         return {
-            'total_messages': len(self.messages),
+            'total_messages': self._get_stats().total,
             'user_count': len(self.users),
             'created_time': self.created_at,
             'expire_time': self.expire_time,
@@ -114,10 +236,18 @@ class ChatRoom:
     def extend_expire_time(self, hours: int = 24):
         """延长聊天室过期时间"""
         self.expire_time = datetime.now() + timedelta(hours=hours)
+        self._notify_expiry()
+        self._save()
         
     def set_max_users(self, max_users: int):
         """设置最大用户数"""
         self.max_users = max_users
+        self._save()
+        
+    def set_text_batching(self, enabled: bool):
+        """开启或关闭文本消息合并发送，消息记录仍逐条保存"""
+        self.text_batching = enabled
+        self._save()
         
     def is_full(self) -> bool:
         """检查聊天室是否已满"""
@@ -135,6 +265,7 @@ class ChatRoom:
         """设置聊天室公告"""
         self.announcement = announcement
         self.announcement_time = datetime.now() if announcement else None
+        self._save()
         
     def get_announcement(self) -> dict:
         """获取聊天室公告"""
@@ -147,11 +278,27 @@ class ChatRoom:
         
     def revoke_message(self, message_id: int) -> bool:
         """撤回消息"""
-        for i, msg in enumerate(self.messages):
-            if msg.get('message_id') == message_id:
-                self.messages.pop(i)
-                return True
-        return False
+        message = self.messages.get(message_id)
+        if message is None or not self.messages.remove(message_id):
+            return False
+        if self._stats is not None:
+            self._stats.remove(message)
+        if self._search_index is not None:
+            self._search_index.remove(message_id)
+        return True
+        
+    def set_delivery_state(self, message_id: int, user_id: int, status: str):
+        """记录消息发给某个成员的投递状态，只保留最近 DELIVERY_STATE_SIZE 条消息"""
+        states = self.delivery_states.get(message_id)
+        if states is None:
+            states = self.delivery_states[message_id] = {}
+            while len(self.delivery_states) > DELIVERY_STATE_SIZE:
+                self.delivery_states.popitem(last=False)
+        states[user_id] = status
+        
+    def get_delivery_state(self, message_id: int) -> dict:
+        """获取消息的投递状态 {user_id: 'pending'/'sent'/'failed'}"""
+        return dict(self.delivery_states.get(message_id, {}))
         
     def pin_message(self, message_id: int, user_id: int) -> bool:
         """置顶消息"""
@@ -161,12 +308,12 @@ class ChatRoom:
         if len(self.pinned_messages) >= self.max_pinned:
             return False
             
-        for msg in self.messages:
-            if msg.get('message_id') == message_id:
-                if message_id not in self.pinned_messages:
-                    self.pinned_messages.append(message_id)
-                return True
-        return False
+        if message_id not in self.messages:
+            return False
+        if message_id not in self.pinned_messages:
+            self.pinned_messages.append(message_id)
+            self._save()
+        return True
         
     def unpin_message(self, message_id: int, user_id: int) -> bool:
         """取消置顶消息"""
@@ -175,53 +322,76 @@ class ChatRoom:
             
         if message_id in self.pinned_messages:
             self.pinned_messages.remove(message_id)
+            self._save()
             return True
         return False
         
     def get_pinned_messages(self) -> list:
         """获取所有置顶消息"""
         pinned = []
-        for msg in self.messages:
-            if msg.get('message_id') in self.pinned_messages:
+        for message_id in self.pinned_messages:
+            msg = self.messages.get(message_id)
+            if msg is not None:
                 pinned.append(msg)
         return pinned
         
     def edit_message(self, message_id: int, user_id: int, new_content: str) -> bool:
         """编辑消息"""
-        for msg in self.messages:
-            if msg.get('message_id') == message_id:
-                if msg['user_id'] != user_id and not self.is_admin(user_id):
-                    return False
-                    
-                # 保存编辑历史
-                if message_id not in self.edited_messages:
-                    self.edited_messages[message_id] = []
-                self.edited_messages[message_id].append({
-                    'old_content': msg['content'],
-                    'edit_time': datetime.now(),
-                    'editor_id': user_id
-                })
-                
-                msg['content'] = new_content
-                msg['edited'] = True
-                msg['last_edit_time'] = datetime.now()
-                return True
-        return False
+        msg = self.messages.get(message_id)
+        if msg is None:
+            return False
+        if msg.user_id != user_id and not self.is_admin(user_id):
+            return False
+            
+        # 保存编辑历史
+        if message_id not in self.edited_messages:
+            self.edited_messages[message_id] = []
+        self.edited_messages[message_id].append({
+            'old_content': msg.content,
+            'edit_time': datetime.now(),
+            'editor_id': user_id
+        })
+        
+        msg.content = new_content
+        msg.edited = True
+        msg.last_edit_time = time.time()
+        self.messages.update(msg)
+        if self._search_index is not None:
+            self._search_index.update(message_id, message_text(msg))
+        self._save()
+        return True
         
     def get_edit_history(self, message_id: int) -> list:
         """获取消息编辑历史"""
         return self.edited_messages.get(message_id, [])
         
-    def add_auto_reply(self, keyword: str, response: str, user_id: int) -> bool:
-        """添加自动回复规则"""
+    def add_auto_reply(self, keyword: str, response: str, user_id: int,
+                       match_type: str = MATCH_CONTAINS) -> bool:
+        """添加自动回复规则
+
+        match_type 可选 'contains'（包含关键词）、'word'（完整单词）或 'regex'（正则表达式）
+        """
         if not self.is_admin(user_id):
             return False
             
-        self.auto_replies[keyword.lower()] = {
+        if match_type not in MATCH_TYPES:
+            return False
+        if match_type == MATCH_REGEX:
+            try:
+                compile_regex(keyword)
+            except ValueError:
+                return False
+        else:
+            keyword = keyword.lower()
+            
+        self.auto_replies[keyword] = {
             'response': response,
             'creator_id': user_id,
-            'created_at': datetime.now()
+            'created_at': datetime.now(),
+            'match_type': match_type
         }
+        self._auto_reply_matcher = None
+        self._save()
         return True
         
     def remove_auto_reply(self, keyword: str, user_id: int) -> bool:
@@ -229,8 +399,12 @@ class ChatRoom:
         if not self.is_admin(user_id):
             return False
             
-        if keyword.lower() in self.auto_replies:
-            del self.auto_replies[keyword.lower()]
+        if keyword not in self.auto_replies:
+            keyword = keyword.lower()
+        if keyword in self.auto_replies:
+            del self.auto_replies[keyword]
+            self._auto_reply_matcher = None
+            self._save()
             return True
         return False
         
@@ -240,11 +414,14 @@ class ChatRoom:
         
     def check_auto_reply(self, message: str) -> str:
         """检查是否触发自动回复"""
-        message = message.lower()
-        for keyword, rule in self.auto_replies.items():
-            if keyword in message:
-                return rule['response']
-        return None
+        if not self.auto_replies:
+            return None
+        if self._auto_reply_matcher is None:
+            self._auto_reply_matcher = AutoReplyMatcher(self.auto_replies)
+        keyword = self._auto_reply_matcher.match(message)
+        if keyword is None:
+            return None
+        return self.auto_replies[keyword]['response']
         
     def add_template(self, name: str, content: str, user_id: int) -> bool:
         """添加消息模板"""
@@ -256,6 +433,7 @@ class ChatRoom:
             'creator_id': user_id,
             'created_at': datetime.now()
         }
+        self._save()
         return True
         
     def remove_template(self, name: str, user_id: int) -> bool:
@@ -265,6 +443,7 @@ class ChatRoom:
             
         if name in self.message_templates:
             del self.message_templates[name]
+            self._save()
             return True
         return False
         
@@ -278,13 +457,11 @@ class ChatRoom:
         
     def get_online_users_list(self) -> list:
         """获取在线用户列表"""
-        current_time = time.time()
-        return [user_id for user_id, last_active in self.online_users.items()
-                if current_time - last_active < self.online_timeout]
+        return self.presence.online_users()
         
     def update_user_activity(self, user_id: int):
         """更新用户活动状态"""
-        self.online_users[user_id] = time.time()
+        self.presence.touch(user_id)
         
     def get_user_status(self, user_id: int) -> str:
         """获取用户状态"""
@@ -296,31 +473,28 @@ class ChatRoom:
             return "创建者"
         if user_id in self.admins:
             return "管理员"
-        if user_id in self.get_online_users_list():
+        if self.presence.is_online(user_id):
             return "在线"
         return "离线"
         
+    def _get_stats(self) -> RoomStats:
+        """消息统计计数，从存储恢复的聊天室第一次调用时读取一遍已有消息"""
+        if self._stats is None:
+            stats = RoomStats()
+            for message in self.messages:
+                stats.add(message)
+            self._stats = stats
+        return self._stats
+        
     def get_room_activity_stats(self) -> dict:
         """获取聊天室活动统计"""
-        message_types = {
-            'text': 0,
-            'photo': 0,
-            'video': 0,
-            'document': 0,
-            'voice': 0,
-            'sticker': 0,
-            'animation': 0
-        }
-        
-        for msg in self.messages:
-            msg_type = msg.get('type')
-            if msg_type in message_types:
-                message_types[msg_type] += 1
-                
+        stats = self._get_stats().snapshot()
         return {
-            'message_types': message_types,
-            'total_messages': len(self.messages),
-            'active_users': len(self.get_online_users_list()),
+            'message_types': stats['message_types'],
+            'total_messages': stats['total_messages'],
+            'user_messages': stats['user_messages'],
+            'hourly_activity': stats['hourly_activity'],
+            'active_users': len(self.presence),
             'total_users': len(self.users),
             'running_time': str(datetime.now() - self.created_at).split('.')[0],
             'expire_in': str(self.expire_time - datetime.now()).split('.')[0]
@@ -0,0 +1,104 @@
+import heapq
+import logging
+import os
+import time
+from datetime import datetime
+from config import MEDIA_DIR
+
+logger = logging.getLogger(__name__)
+
+
+class RoomCleaner:
+    """过期聊天室清理
+
+    聊天室按过期时间放入小顶堆，每次清理只弹出已到期的聊天室，不需要遍历所有聊天室。
+    track 登记为 ChatRoom.expiry_hooks 后，新建、恢复和修改过期时间的聊天室都会按新的时间入堆，
+    旧的堆项弹出时发现聊天室还没到期就直接丢弃。
+    """
+
+    def __init__(self, chat_rooms: dict, user_manager, media_dir: str = MEDIA_DIR,
+                 media_store=None):
+        self.chat_rooms = chat_rooms
+        self.user_manager = user_manager
+        self.media_dir = media_dir
+        self.media_store = media_store  # 共享媒体存储，聊天室的媒体文件是指向它的硬链接
+        self.release_hooks = []  # 聊天室关闭后调用 hook(room_id)，用于释放其他资源
+        self._heap = []  # (过期时间戳, room_id)
+
+    def track(self, room):
+        """登记聊天室的过期时间"""
+        heapq.heappush(self._heap, (room.expire_time.timestamp(), room.room_id))
+
+    def _pop_expired(self, now: datetime) -> list:
+        """弹出所有已过期的聊天室"""
+        expired = {}
+        deadline = now.timestamp()
+        while self._heap and self._heap[0][0] <= deadline:
+            _, room_id = heapq.heappop(self._heap)
+            room = self.chat_rooms.get(room_id)
+            if room is None or room_id in expired:
+                continue
+            if room.expire_time > now:  # 过期时间被延长了，新的时间已经入堆
+                continue
+            expired[room_id] = room
+        return list(expired.values())
+
+    def _remove_media(self, room_ids: set):
+        """扫描一次媒体目录，批量删除这些聊天室的媒体文件
+
+        共享文件的硬链接只算作释放引用，不计入回收的字节数
+        """
+        files = 0
+        size = 0
+        try:
+            entries = list(os.scandir(self.media_dir))
+        except FileNotFoundError:
+            return files, size
+        for entry in entries:
+            room_id = entry.name.split('_', 1)[0]
+            if room_id not in room_ids or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+                os.unlink(entry.path)
+            except OSError as e:
+                logger.warning(f"Failed to remove {entry.path}: {e}")
+                continue
+            files += 1
+            if stat.st_nlink <= 1:
+                size += stat.st_size
+        return files, size
+
+    def _release_room(self, room):
+        """关闭聊天室并释放相关记录"""
+        self.user_manager.remove_room(room.room_id)
+        room.close_room()
+        self.chat_rooms.pop(room.room_id, None)
+        for hook in self.release_hooks:
+            try:
+                hook(room.room_id)
+            except Exception as e:
+                logger.error(f"Cleanup hook failed for room {room.room_id}: {e}")
+
+    def sweep(self, now: datetime = None) -> dict:
+        """清理所有已过期的聊天室，返回本次清理的统计"""
+        started = time.monotonic()
+        expired = self._pop_expired(now or datetime.now())
+        for room in expired:
+            self._release_room(room)
+        files, size = self._remove_media({room.room_id for room in expired}) if expired else (0, 0)
+        if self.media_store is not None:
+            collected_files, collected_size = self.media_store.collect()
+            files += collected_files
+            size += collected_size
+
+        report = {
+            'rooms': len(expired),
+            'files': files,
+            'bytes': size,
+            'duration': time.monotonic() - started
+        }
+        if expired:
+            logger.info(f"Cleanup removed {report['rooms']} rooms, {files} files "
+                        f"({size / 1024 / 1024:.1f} MB) in {report['duration']:.3f}s")
+        return report
@@ -7,6 +7,7 @@ MAX_ROOMS_PER_USER = 3  # 每个用户最多可创建的聊天室数量
 ROOM_EXPIRE_HOURS = 24  # 聊天室过期时间（小时）
 MAX_USERS_PER_ROOM = 50  # 每个聊天室的最大用户数
 MAX_MESSAGE_LENGTH = 4096  # 最大消息长度
+BOT_ADMINS = set()  # 可以使用 /ban 在所有聊天室封禁用户的用户ID
 
 # 媒体文件配置
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 最大文件大小（20MB）
@@ -16,10 +17,65 @@ ALLOWED_FILE_TYPES = {
     'document': ['application/pdf', 'application/msword', 'text/plain'],
     'audio': ['audio/mpeg', 'audio/ogg']
 }
+MIME_SNIFF_BYTES = 8192  # 判断文件类型时读取的文件开头字节数
 
 # 路径配置
 MEDIA_DIR = "media"
 QR_CODES_DIR = "qr_codes"
+QR_CACHE_SIZE = 256  # 内存中缓存的二维码数量
+QR_WORKERS = 2  # 生成二维码的进程数
+LOCALES_DIR = "locales"  # 翻译文件目录，{语言}.json 覆盖内置文本
+LOCALES_RELOAD_INTERVAL = 60  # 检查翻译文件是否更新的间隔（秒）
+
+# 消息发送配置
+FANOUT_CONCURRENCY = 10  # 同时发送消息的 worker 数量
+TELEGRAM_RATE_LIMIT = 30  # 全局每秒最多发送的消息数（Telegram 限制约 30 条/秒）
+ROOM_QUEUE_SIZE = 100  # 每个聊天室最多排队等待处理的消息数
+ROOM_QUEUE_OVERFLOW = 'reject'  # 队列满时的处理方式：reject / drop_newest / drop_oldest
+CONNECTION_POOL_SIZE = 64  # Bot API 和文件下载的 HTTP 连接池大小
+OUTBOX_MAX_RETRIES = 5  # 网络错误时最多重试次数
+OUTBOX_RETRY_BASE = 1.0  # 第一次重试前等待的秒数，之后每次翻倍
+OUTBOX_RETRY_MAX_DELAY = 60  # 重试等待的最长秒数
+DELIVERY_STATE_SIZE = 200  # 每个聊天室保留投递状态的最近消息数
+TEXT_BATCH_WINDOW = 0.5  # 开启合并发送的聊天室，文本消息等待合并的秒数
+NAME_CACHE_TTL = 3600  # 用户昵称缓存时间（秒）
+NAME_CACHE_SIZE = 10000  # 最多缓存的用户昵称数量
+
+# Webhook 配置（USE_WEBHOOK 为 False 时使用长轮询）
+USE_WEBHOOK = False
+WEBHOOK_URL = ""  # Telegram 访问的公网地址，例如 https://example.com/webhook
+WEBHOOK_LISTEN = "127.0.0.1"  # 本地监听地址（通常在反向代理之后）
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = ""  # 与 Telegram 约定的 secret token，留空时每次启动随机生成
+WEBHOOK_SECRET_FILE = "data/webhook_secret"  # 随机生成的 secret token 写在这里，供 webhook_replay.py 读取
+WEBHOOK_MAX_BODY = 1024 * 1024  # 请求体最大字节数
+WEBHOOK_QUEUE_SIZE = 1000  # 待处理 Update 队列长度，满时返回 503
+WEBHOOK_WORKERS = 8  # 同时处理 Update 的 worker 数量
+
+# 存储配置
+DB_PATH = "data/bot.db"  # SQLite 数据库文件
+STORAGE_FLUSH_INTERVAL = 1.0  # 后台批量写入间隔（秒）
+STORAGE_BATCH_SIZE = 500  # 积累多少条写操作后立即写入
+STORAGE_RETRY_MAX_DELAY = 30  # 写入失败后重试的最长等待时间（秒），之前每次失败等待时间翻倍
+MESSAGE_LOG_DIR = "data/messages"  # 聊天室消息日志目录
+MESSAGE_SEGMENT_SIZE = 16 * 1024 * 1024  # 单个消息日志分段的大小（16MB）
+MESSAGE_TAIL_SIZE = 500  # 每个聊天室保留在内存中的最近消息数
+
+# 搜索配置
+SEARCH_PAGE_SIZE = 10  # 每页显示的搜索结果数
+
+# 自动回复配置
+AUTO_REPLY_REGEX_MAX_LENGTH = 100  # 正则规则的最大长度
+AUTO_REPLY_REGEX_MAX_INPUT = 1000  # 正则规则只匹配消息的前多少个字符
+
+# 统计配置
+STATS_HOURS = 168  # 按小时统计活跃度时保留的小时数（7天）
+
+# 导出配置
+EXPORT_DIR = "exports"  # 导出文件目录
+EXPORT_CHUNK_SIZE = 500  # 每写入多少条消息让出一次事件循环
+EXPORT_MAX_AGE = 86400  # 导出文件保留时间（秒），超过后在定时清理时删除
 
 # 清理配置
 CLEANUP_INTERVAL = 30  # 清理间隔（分钟）
@@ -0,0 +1,118 @@
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from config import EXPORT_DIR, EXPORT_CHUNK_SIZE, EXPORT_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _line(data: dict) -> bytes:
+    return (json.dumps(data, default=_encode, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class ChatExporter:
+    """流式导出聊天记录
+
+    按 ID 顺序逐条从消息存储读取，写成 gzip 压缩的 JSON Lines，内存占用与记录条数无关。
+    第一行 {"export": ...} 是导出信息，之后每行一条消息（附带编辑历史），
+    最后一行 {"end": ...} 记录本次导出的条数和最后一个 ID，
+    下次传入 since_id 即可只导出新消息。媒体消息只导出路径和 file_id，不读取文件内容。
+    导出文件在聊天室关闭时（remove_room_exports）或超过 max_age 后（sweep）删除。
+    """
+
+    def __init__(self, export_dir: str = EXPORT_DIR, chunk_size: int = EXPORT_CHUNK_SIZE,
+                 max_age: float = EXPORT_MAX_AGE):
+        self.export_dir = export_dir
+        self.chunk_size = chunk_size
+        self.max_age = max_age
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Failed to remove export {path}: {e}")
+            return False
+        return True
+
+    def remove_room_exports(self, room_id: str) -> int:
+        """聊天室关闭后删除它的导出文件，可以作为 RoomCleaner 的 release hook"""
+        pattern = os.path.join(glob.escape(self.export_dir), f"{glob.escape(room_id)}_*")
+        removed = sum(self._remove(path) for path in glob.glob(pattern))
+        if removed:
+            logger.info(f"Removed {removed} export files of room {room_id}")
+        return removed
+
+    def sweep(self, now: float = None) -> int:
+        """删除超过 max_age 的导出文件，返回删除的文件数"""
+        deadline = (now or time.time()) - self.max_age
+        try:
+            entries = list(os.scandir(self.export_dir))
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for entry in entries:
+            try:
+                if not entry.is_file() or entry.stat().st_mtime > deadline:
+                    continue
+            except OSError:
+                continue
+            removed += self._remove(entry.path)
+        if removed:
+            logger.info(f"Removed {removed} expired export files")
+        return removed
+
+    def _record(self, room, message) -> dict:
+        record = message.to_dict()
+        history = room.edited_messages.get(message.message_id)
+        if history:
+            record['edit_history'] = history
+        return record
+
+    async def export(self, room, since_id: int = 0, path: str = None) -> dict:
+        """导出 since_id 之后的消息，返回 {'path', 'count', 'last_id'}
+
+        每写入 chunk_size 条消息让出一次事件循环，导出大聊天室时不会阻塞其他消息。
+        """
+        if path is None:
+            os.makedirs(self.export_dir, exist_ok=True)
+            stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+            path = os.path.join(self.export_dir, f"{room.room_id}_{since_id}_{stamp}.jsonl.gz")
+        partial = f"{path}.part"
+        count = 0
+        last_id = since_id
+        try:
+            with gzip.open(partial, 'wb') as f:
+                f.write(_line({'export': {
+                    'room_id': room.room_id,
+                    'since_id': since_id,
+                    'exported_at': datetime.now()
+                }}))
+                for message in room.messages.iter_after(since_id):
+                    f.write(_line(self._record(room, message)))
+                    count += 1
+                    last_id = message.message_id
+                    if count % self.chunk_size == 0:
+                        await asyncio.sleep(0)
+                f.write(_line({'end': {'count': count, 'last_id': last_id}}))
+            os.replace(partial, path)
+        except Exception:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        logger.info(f"Exported {count} messages from room {room.room_id} to {path}")
+        return {'path': path, 'count': count, 'last_id': last_id}
@@ -1,3 +1,12 @@
+import json
+import logging
+import os
+import re
+import string
+from config import LOCALES_DIR
+
+logger = logging.getLogger(__name__)
+
 LANGUAGES = {
     'zh': {
         'name': '中文',
@@ -47,11 +56,157 @@ LANGUAGES = {
 
 DEFAULT_LANGUAGE = 'zh'
 
+# 语言的回退顺序，未列出的语言依次回退到同一语种（zh-TW -> zh）和 DEFAULT_LANGUAGE
+LANGUAGE_FALLBACKS = {}
+
+_formatter = string.Formatter()
+
+
+class Template:
+    """预编译的文本模板
+
+    加载时解析一次占位符，没有占位符的文本直接缓存渲染结果。
+    和以前的 get_text 一样，只有传了参数才渲染（包括把 {{ }} 还原成花括号），否则返回原始文本。
+    """
+
+    __slots__ = ('text', 'fields', 'rendered')
+
+    def __init__(self, text: str):
+        self.text = text
+        # 格式错误（例如不成对的花括号）在加载时就抛出 ValueError
+        self.fields = frozenset(
+            re.split(r'[.\[]', field, 1)[0]
+            for _, field, _, _ in _formatter.parse(text) if field is not None
+        )
+        if '' in self.fields or any(name.isdigit() for name in self.fields):
+            raise ValueError(f"Positional placeholders are not supported: {text[:40]!r}")
+        self.rendered = text.format() if not self.fields else None
+
+    def render(self, kwargs: dict) -> str:
+        if not kwargs:
+            return self.text
+        if self.rendered is not None:
+            return self.rendered
+        missing = self.fields.difference(kwargs)
+        if missing:
+            raise KeyError(f"Missing placeholders: {', '.join(sorted(missing))}")
+        return self.text.format(**kwargs)
+
+
+def _compile(languages: dict) -> dict:
+    """编译所有语言的模板，出错时抛出 ValueError 并指明是哪一条"""
+    compiled = {}
+    for lang, texts in languages.items():
+        table = {}
+        for key, text in texts.items():
+            try:
+                table[key] = Template(text)
+            except ValueError as e:
+                raise ValueError(f"Invalid template {lang}.{key}: {e}") from None
+        compiled[lang] = table
+    return compiled
+
+
+class Catalog:
+    """多语言文本目录
+
+    所有模板在加载时编译并检查占位符，每种语言的回退链只计算一次。
+    reload() 从 LOCALES_DIR 下的 {语言}.json 重新加载翻译，新文本全部编译通过后才替换，
+    不需要重启机器人。
+    """
+
+    def __init__(self, languages: dict, default: str = DEFAULT_LANGUAGE,
+                 fallbacks: dict = None, locales_dir: str = LOCALES_DIR):
+        self.default = default
+        self.fallbacks = fallbacks if fallbacks is not None else LANGUAGE_FALLBACKS
+        self.locales_dir = locales_dir
+        self._builtin = languages
+        self._mtimes = {}
+        self._install(_compile(languages))
+
+    def _install(self, compiled: dict):
+        chains = {}
+        for lang in compiled:
+            chains[lang] = self._build_chain(lang, compiled)
+        # 一次性替换，正在渲染的调用仍使用旧的目录
+        self._compiled, self._chains = compiled, chains
+
+    def _build_chain(self, lang: str, compiled: dict) -> tuple:
+        order = [lang, *self.fallbacks.get(lang, ()), lang.split('-', 1)[0], self.default]
+        chain = []
+        for name in dict.fromkeys(order):
+            if name in compiled:
+                chain.append(compiled[name])
+        return tuple(chain)
+
+    def get(self, key: str, lang: str = DEFAULT_LANGUAGE, **kwargs) -> str:
+        """获取指定语言的文本，不存在时按回退链查找"""
+        chain = self._chains.get(lang)
+        if chain is None:
+            chain = self._build_chain(lang, self._compiled)
+        for table in chain:
+            template = table.get(key)
+            if template is not None:
+                return template.render(kwargs)
+        raise KeyError(f"Unknown text key: {key}")
+
+    def _locale_files(self) -> dict:
+        try:
+            names = os.listdir(self.locales_dir)
+        except FileNotFoundError:
+            return {}
+        return {name[:-5]: os.path.join(self.locales_dir, name)
+                for name in names if name.endswith('.json')}
+
+    def reload(self):
+        """从翻译文件重新加载，文件中的文本覆盖内置文本"""
+        files = self._locale_files()
+        languages = {lang: dict(texts) for lang, texts in self._builtin.items()}
+        mtimes = {}
+        for lang, path in files.items():
+            mtimes[path] = os.path.getmtime(path)
+            with open(path, encoding='utf-8') as f:
+                texts = json.load(f)
+            languages.setdefault(lang, {}).update(self._validate(path, texts))
+        self._install(_compile(languages))
+        self._mtimes = mtimes
+        logger.info(f"Loaded translations for {len(files)} languages from {self.locales_dir}")
+
+    @staticmethod
+    def _validate(path: str, texts) -> dict:
+        """翻译文件必须是 {键: 文本} 的 JSON 对象，格式不对的条目跳过"""
+        if not isinstance(texts, dict):
+            logger.error(f"Ignoring {path}: expected a JSON object of strings")
+            return {}
+        valid = {}
+        for key, text in texts.items():
+            if isinstance(text, str):
+                valid[key] = text
+            else:
+                logger.warning(f"Ignoring {path}: value of {key!r} is not a string")
+        return valid
+
+    def reload_if_changed(self) -> bool:
+        """翻译文件有变化时重新加载，加载失败时保留原来的文本"""
+        files = self._locale_files()
+        try:
+            mtimes = {path: os.path.getmtime(path) for path in files.values()}
+        except OSError:
+            return False
+        if mtimes == self._mtimes:
+            return False
+        try:
+            self.reload()
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to reload translations: {e}")
+            self._mtimes = mtimes  # 文件再次修改前不重试
+            return False
+        return True
+
+
+catalog = Catalog(LANGUAGES)
+
+
 def get_text(key, lang=DEFAULT_LANGUAGE, **kwargs):
     """获取指定语言的文本"""
-    try:
-        text = LANGUAGES[lang][key]
-        return text.format(**kwargs) if kwargs else text
-    except KeyError:
-        # 如果找不到对应语言或文本，返回默认语言
-        return LANGUAGES[DEFAULT_LANGUAGE][key].format(**kwargs) if kwargs else LANGUAGES[DEFAULT_LANGUAGE][key] 
\ No newline at end of file
+    return catalog.get(key, lang, **kwargs)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import shutil
+from collections import Counter
+from config import MEDIA_DIR
+from mime_sniff import stream_download, sniff_file, UnsupportedFileType
+
+logger = logging.getLogger(__name__)
+
+
+class MediaStore:
+    """按内容寻址的媒体文件存储
+
+    文件以 Telegram 的 file_unique_id 为键保存在 media/objects/ 下，同一个文件只下载一次。
+    每个聊天室通过硬链接 media/{room_id}_{file_unique_id}{后缀} 引用它，
+    硬链接数就是引用计数：清理聊天室时只删除它自己的链接，
+    collect() 再删除已经没有聊天室引用的文件。
+    """
+
+    def __init__(self, media_dir: str = MEDIA_DIR):
+        self.media_dir = media_dir
+        self.objects_dir = os.path.join(media_dir, 'objects')
+        self._downloads = {}  # file_unique_id -> 正在进行的下载任务
+        self._pinned = Counter()  # file_unique_id -> 还没建好链接的 fetch 数，collect() 不会删除这些文件
+
+    def _object_path(self, key: str) -> str:
+        return os.path.join(self.objects_dir, key)
+
+    async def fetch(self, media, room_id: str, suffix: str = '', allowed_types=None) -> str:
+        """取得媒体文件在聊天室中的路径，文件已存在时跳过下载
+
+        media 为 Telegram 的 PhotoSize、Video、Document 等对象。
+        指定 allowed_types 时先检查文件类型，不允许的类型抛出 UnsupportedFileType，
+        下载中的文件只会读取开头几 KB。
+        """
+        key = media.file_unique_id
+        path = os.path.join(self.media_dir, f"{room_id}_{key}{suffix}")
+        obj = self._object_path(key)
+        checked = False
+        # 下载完成到建好链接之间文件的链接数为 1，固定住它，避免被同时运行的 collect() 删除
+        self._pinned[key] += 1
+        try:
+            if not os.path.exists(obj):
+                task = self._downloads.get(key)
+                if task is None:
+                    task = asyncio.ensure_future(self._download(media, obj, allowed_types))
+                    self._downloads[key] = task
+                    task.add_done_callback(lambda _: self._downloads.pop(key, None))
+                    checked = True
+                await asyncio.shield(task)
+            if allowed_types is not None and not checked:
+                mime_type = sniff_file(obj)
+                if mime_type not in allowed_types:
+                    raise UnsupportedFileType(mime_type)
+            if not os.path.exists(path):
+                self._link(obj, path)
+        finally:
+            self._pinned[key] -= 1
+            if not self._pinned[key]:
+                del self._pinned[key]
+        return path
+
+    async def _download(self, media, obj: str, allowed_types=None):
+        os.makedirs(self.objects_dir, exist_ok=True)
+        partial = f"{obj}.part"
+        file = await media.get_file()
+        try:
+            await stream_download(file.file_path, partial, allowed_types)
+        except Exception:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        os.replace(partial, obj)
+
+    def _link(self, obj: str, path: str):
+        try:
+            os.link(obj, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # 文件系统不支持硬链接时退化为复制
+            shutil.copyfile(obj, path)
+
+    def collect(self):
+        """删除没有任何聊天室引用的文件，返回 (文件数, 字节数)"""
+        files = 0
+        size = 0
+        try:
+            entries = list(os.scandir(self.objects_dir))
+        except FileNotFoundError:
+            return files, size
+        for entry in entries:
+            if entry.name.endswith('.part') or entry.name in self._pinned:
+                continue
+            try:
+                stat = entry.stat()
+                if stat.st_nlink > 1:
+                    continue
+                os.unlink(entry.path)
+            except OSError as e:
+                logger.warning(f"Failed to remove {entry.path}: {e}")
+                continue
+            files += 1
+            size += stat.st_size
+        return files, size
@@ -0,0 +1,100 @@
+_EMPTY = {}  # 查询不存在的用户时使用的空 dict，不会被修改
+
+
+class MembershipIndex:
+    """用户和聊天室的双向成员关系索引
+
+    同时维护 用户 -> 聊天室 和 聊天室 -> 用户 两个方向，两边总在同一次调用中更新，
+    ChatRoom 的成员列表和 UserManager 的用户聊天室列表都来自这里，不会互相不一致。
+    两个方向的查询都是 O(1)，不需要遍历所有聊天室。
+
+    成员集合用只有键的 dict 保存，对外返回它的 keys() 视图：只读、随索引实时更新，
+    支持 in、len、迭代和集合运算。
+    """
+
+    def __init__(self):
+        self._rooms_by_user = {}  # 用户ID -> {聊天室ID: None}
+        self._users_by_room = {}  # 聊天室ID -> {用户ID: None}，聊天室关闭前一直保留
+        self._occupied = 0  # 有成员的聊天室数量
+
+    def _room(self, room_id: str) -> dict:
+        users = self._users_by_room.get(room_id)
+        if users is None:
+            users = self._users_by_room[room_id] = {}
+        return users
+
+    def add(self, user_id: int, room_id: str) -> bool:
+        """加入成员关系，已存在时返回 False"""
+        users = self._room(room_id)
+        if user_id in users:
+            return False
+        if not users:
+            self._occupied += 1
+        users[user_id] = None
+        self._rooms_by_user.setdefault(user_id, {})[room_id] = None
+        return True
+
+    def remove(self, user_id: int, room_id: str) -> bool:
+        """删除成员关系，不存在时返回 False"""
+        users = self._users_by_room.get(room_id)
+        if users is None or user_id not in users:
+            return False
+        del users[user_id]
+        if not users:
+            self._occupied -= 1
+        self._discard_room(user_id, room_id)
+        return True
+
+    def remove_room(self, room_id: str) -> set:
+        """删除聊天室的所有成员关系，返回原来的成员"""
+        users = self._users_by_room.pop(room_id, {})
+        if users:
+            self._occupied -= 1
+        for user_id in users:
+            self._discard_room(user_id, room_id)
+        return set(users)
+
+    def remove_user(self, user_id: int) -> set:
+        """删除用户的所有成员关系，返回原来所在的聊天室"""
+        rooms = self._rooms_by_user.pop(user_id, {})
+        for room_id in rooms:
+            users = self._users_by_room[room_id]
+            del users[user_id]
+            if not users:
+                self._occupied -= 1
+        return set(rooms)
+
+    def _discard_room(self, user_id: int, room_id: str):
+        rooms = self._rooms_by_user[user_id]
+        del rooms[room_id]
+        if not rooms:
+            del self._rooms_by_user[user_id]
+
+    def rooms_of(self, user_id: int):
+        """用户所在的聊天室（只读视图）"""
+        rooms = self._rooms_by_user.get(user_id)
+        return rooms.keys() if rooms is not None else _EMPTY.keys()
+
+    def users_of(self, room_id: str):
+        """聊天室的成员（只读视图，成员变化后仍然有效，直到聊天室被 remove_room 删除）"""
+        return self._room(room_id).keys()
+
+    def is_member(self, user_id: int, room_id: str) -> bool:
+        """用户是否在聊天室中"""
+        return user_id in self._users_by_room.get(room_id, _EMPTY)
+
+    def room_ids(self) -> list:
+        """有成员的聊天室"""
+        return [room_id for room_id, users in self._users_by_room.items() if users]
+
+    def room_count(self) -> int:
+        """有成员的聊天室数量"""
+        return self._occupied
+
+    def user_count(self) -> int:
+        """至少在一个聊天室中的用户数量"""
+        return len(self._rooms_by_user)
+
+
+# 全局共享的成员关系索引
+membership = MembershipIndex()
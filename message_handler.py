@@ -1,23 +1,41 @@
-from telegram import ParseMode, Update
-from telegram.ext import CallbackContext
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+from telegram.error import RetryAfter
 import os
-import magic
+import logging
 from config import *
+from outbox import Outbox, STATUS_SENT, STATUS_FAILED
+from name_cache import name_cache
+from media_store import MediaStore
+from mime_sniff import sniff_file, UnsupportedFileType
+from room_scheduler import RoomScheduler, RoomQueueFull
+
+logger = logging.getLogger(__name__)
 
 class MessageHandler:
-    def __init__(self, chat_rooms):
+    def __init__(self, chat_rooms, outbox: Outbox = None, media_store: MediaStore = None,
+                 scheduler: RoomScheduler = None):
         self.chat_rooms = chat_rooms
+        self.outbox = outbox or Outbox(chat_rooms)
+        self.media_store = media_store or MediaStore()
+        self.scheduler = scheduler or RoomScheduler()
         
-    async def handle_message(self, update: Update, context: CallbackContext):
-        """处理接收到的消息"""
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理接收到的消息
+
+        这里只做检查并放入聊天室的任务队列，很快就会返回，所以 webhook 队列看不到真正的处理时间，
+        限流由聊天室队列负责：队列满时回复用户稍后再试（ROOM_QUEUE_SIZE / ROOM_QUEUE_OVERFLOW）。
+        """
         if not update.message:
             return
             
         user_id = update.effective_user.id
+        name_cache.update_from_user(update.effective_user)
         room_id = context.user_data.get('current_room')
         
         if not room_id or room_id not in self.chat_rooms:
-            update.message.reply_text("请先加入聊天室！")
+            await update.message.reply_text("请先加入聊天室！")
             return
             
         room = self.chat_rooms[room_id]
@@ -27,9 +45,22 @@ class MessageHandler:
         
         # 检查用户是否被禁言
         if user_id in room.banned_users:
-            update.message.reply_text("您已被禁止在此聊天室发言")
+            await update.message.reply_text("您已被禁止在此聊天室发言")
             return
             
+        # 放入聊天室的任务队列，同一聊天室内按顺序处理，不同聊天室并行
+        try:
+            self.scheduler.submit(room_id, lambda: self._process_message(update, context, room, user_id))
+        except RoomQueueFull:
+            await update.message.reply_text("聊天室消息过多，请稍后再试")
+
+    async def _process_message(self, update, context, room, user_id):
+        """按消息类型处理并广播"""
+        if not room.is_active:
+            # 排队期间聊天室已过期或被关闭，丢弃这条消息
+            logger.info(f"Dropping queued message for closed room {room.room_id}")
+            return
+        self.outbox.start(context.bot)
         try:
             # 处理不同类型的消息
             if update.message.text:
@@ -43,254 +74,242 @@ class MessageHandler:
                 await self._handle_photo(update, context, room, user_id)
             elif update.message.video:
                 await self._handle_video(update, context, room, user_id)
+            elif update.message.animation:
+                # 动图消息同时带有 document 字段，要先于文件判断
+                await self._handle_animation(update, context, room, user_id)
             elif update.message.document:
                 await self._handle_document(update, context, room, user_id)
             elif update.message.voice:
                 await self._handle_voice(update, context, room, user_id)
             elif update.message.sticker:
                 await self._handle_sticker(update, context, room, user_id)
-            elif update.message.animation:
-                await self._handle_animation(update, context, room, user_id)
         except Exception as e:
-            update.message.reply_text("消息发送失败，请重试")
-            raise e
+            # 在聊天室队列中执行，异常不会回到 PTB，需要自己交给 application 的错误处理
+            await context.application.process_error(update, e)
+            await update.message.reply_text("消息发送失败，请重试")
 
     async def _handle_text(self, update, context, room, user_id):
         """处理文本消息"""
         text = update.message.text
         if len(text) > MAX_MESSAGE_LENGTH:
-            update.message.reply_text(f"消息长度不能超过 {MAX_MESSAGE_LENGTH} 字符")
+            await update.message.reply_text(f"消息长度不能超过 {MAX_MESSAGE_LENGTH} 字符")
             return
             
-        room.add_message(user_id, 'text', text)
-        await self._broadcast_text(context, room, user_id, text)
+        message = room.add_message(user_id, 'text', text)
+        await self._broadcast_text(context, room, user_id, message.message_id, text)
 
     async def _handle_photo(self, update, context, room, user_id):
         """处理图片消息"""
         photo = update.message.photo[-1]  # 获取最大尺寸的图片
         if photo.file_size > MAX_FILE_SIZE:
-            update.message.reply_text("图片大小超过限制")
+            await update.message.reply_text("图片大小超过限制")
             return
             
-        file = await photo.get_file()
-        file_path = f"{MEDIA_DIR}/{room.room_id}_{file.file_id}.jpg"
-        await file.download_to_drive(file_path)
+        file_path = await self.media_store.fetch(photo, room.room_id, '.jpg')
         
         caption = update.message.caption or ""
-        room.add_message(user_id, 'photo', {'path': file_path, 'caption': caption})
-        await self._broadcast_photo(context, room, user_id, file_path, caption)
+        message = room.add_message(user_id, 'photo', {'path': file_path, 'caption': caption, 'file_id': photo.file_id})
+        await self._broadcast_photo(context, room, user_id, message.message_id, file_path, caption, photo.file_id)
 
     async def _handle_video(self, update, context, room, user_id):
         """处理视频消息"""
         video = update.message.video
         if video.file_size > MAX_FILE_SIZE:
-            update.message.reply_text("视频大小超过限制")
+            await update.message.reply_text("视频大小超过限制")
             return
             
-        file = await video.get_file()
-        file_path = f"{MEDIA_DIR}/{room.room_id}_{file.file_id}.mp4"
-        await file.download_to_drive(file_path)
+        file_path = await self.media_store.fetch(video, room.room_id, '.mp4')
         
         caption = update.message.caption or ""
-        room.add_message(user_id, 'video', {'path': file_path, 'caption': caption})
-        await self._broadcast_video(context, room, user_id, file_path, caption)
+        message = room.add_message(user_id, 'video', {'path': file_path, 'caption': caption, 'file_id': video.file_id})
+        await self._broadcast_video(context, room, user_id, message.message_id, file_path, caption, video.file_id)
 
     async def _handle_document(self, update, context, room, user_id):
         """处理文件消息"""
         doc = update.message.document
         if doc.file_size > MAX_FILE_SIZE:
-            update.message.reply_text("文件大小超过限制")
+            await update.message.reply_text("文件大小超过限制")
             return
             
-        file = await doc.get_file()
-        file_path = f"{MEDIA_DIR}/{room.room_id}_{file.file_id}_{doc.file_name}"
-        await file.download_to_drive(file_path)
-        
-        # 检查文件类型是否允许
-        if not self._check_file_type(file_path, ALLOWED_FILE_TYPES['document']):
-            os.remove(file_path)
-            update.message.reply_text("不支持的文件类型")
+        # 下载时先检查文件类型，不允许的类型只会下载开头几 KB
+        try:
+            file_path = await self.media_store.fetch(
+                doc, room.room_id, f"_{doc.file_name}", ALLOWED_FILE_TYPES['document']
+            )
+        except UnsupportedFileType:
+            await update.message.reply_text("不支持的文件类型")
             return
             
         caption = update.message.caption or ""
-        room.add_message(user_id, 'document', {
+        message = room.add_message(user_id, 'document', {
             'path': file_path, 
             'caption': caption,
-            'file_name': doc.file_name
+            'file_name': doc.file_name,
+            'file_id': doc.file_id
         })
-        await self._broadcast_document(context, room, user_id, file_path, doc.file_name, caption)
+        await self._broadcast_document(context, room, user_id, message.message_id, file_path, doc.file_name, caption, doc.file_id)
 
     async def _handle_voice(self, update, context, room, user_id):
         """处理语音消息"""
         voice = update.message.voice
         if voice.file_size > MAX_FILE_SIZE:
-            update.message.reply_text("语音消息大小超过限制")
+            await update.message.reply_text("语音消息大小超过限制")
             return
             
-        file = await voice.get_file()
-        file_path = f"{MEDIA_DIR}/{room.room_id}_{file.file_id}.ogg"
-        await file.download_to_drive(file_path)
+        file_path = await self.media_store.fetch(voice, room.room_id, '.ogg')
         
         caption = update.message.caption or ""
-        room.add_message(user_id, 'voice', {'path': file_path, 'caption': caption})
-        await self._broadcast_voice(context, room, user_id, file_path, caption)
+        message = room.add_message(user_id, 'voice', {'path': file_path, 'caption': caption, 'file_id': voice.file_id})
+        await self._broadcast_voice(context, room, user_id, message.message_id, file_path, caption, voice.file_id)
 
     async def _handle_sticker(self, update, context, room, user_id):
         """处理贴纸消息"""
         sticker = update.message.sticker
-        file = await sticker.get_file()
-        file_path = f"{MEDIA_DIR}/{room.room_id}_{file.file_id}.webp"
-        await file.download_to_drive(file_path)
+        file_path = await self.media_store.fetch(sticker, room.room_id, '.webp')
         
-        room.add_message(user_id, 'sticker', {'path': file_path})
-        await self._broadcast_sticker(context, room, user_id, file_path)
+        message = room.add_message(user_id, 'sticker', {'path': file_path, 'file_id': sticker.file_id})
+        await self._broadcast_sticker(context, room, user_id, message.message_id, file_path, sticker.file_id)
 
     async def _handle_animation(self, update, context, room, user_id):
         """处理GIF动图消息"""
         animation = update.message.animation
         if animation.file_size > MAX_FILE_SIZE:
-            update.message.reply_text("GIF大小超过限制")
+            await update.message.reply_text("GIF大小超过限制")
             return
             
-        file = await animation.get_file()
-        file_path = f"{MEDIA_DIR}/{room.room_id}_{file.file_id}.gif"
-        await file.download_to_drive(file_path)
+        file_path = await self.media_store.fetch(animation, room.room_id, '.gif')
         
         caption = update.message.caption or ""
-        room.add_message(user_id, 'animation', {'path': file_path, 'caption': caption})
-        await self._broadcast_animation(context, room, user_id, file_path, caption)
+        message = room.add_message(user_id, 'animation', {'path': file_path, 'caption': caption, 'file_id': animation.file_id})
+        await self._broadcast_animation(context, room, user_id, message.message_id, file_path, caption, animation.file_id)
+
+    async def _get_sender_name(self, context, sender_id):
+        """获取发送者昵称，优先读缓存"""
+        sender_name = name_cache.get(sender_id)
+        if sender_name is None:
+            sender = await context.bot.get_chat_member(sender_id, sender_id)
+            sender_name = sender.user.first_name
+            name_cache.set(sender_id, sender_name)
+        return sender_name
 
-    async def _broadcast_text(self, context, room, sender_id, text):
+    async def _broadcast_text(self, context, room, sender_id, message_id, text):
         """广播文本消息"""
-        sender = await context.bot.get_chat_member(sender_id, sender_id)
-        sender_name = sender.user.first_name
+        sender_name = await self._get_sender_name(context, sender_id)
         
-        for user_id in room.users:
-            if user_id != sender_id:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"{sender_name}: {text}",
-                    parse_mode=ParseMode.HTML
-                )
+        recipients = [user_id for user_id in room.users if user_id != sender_id]
+        self.outbox.broadcast(
+            recipients, 'send_message', room.room_id, message_id, room.text_batching, sender_id,
+            text=f"{sender_name}: {text}",
+            parse_mode=ParseMode.HTML
+        )
 
-    async def _broadcast_photo(self, context, room, sender_id, file_path, caption):
+    async def _broadcast_photo(self, context, room, sender_id, message_id, file_path, caption, file_id=None):
         """广播图片消息"""
-        sender = await context.bot.get_chat_member(sender_id, sender_id)
-        sender_name = sender.user.first_name
+        sender_name = await self._get_sender_name(context, sender_id)
         
-        for user_id in room.users:
-            if user_id != sender_id:
-                with open(file_path, 'rb') as photo:
-                    await context.bot.send_photo(
-                        chat_id=user_id,
-                        photo=photo,
-                        caption=f"{sender_name}: {caption}" if caption else sender_name,
-                        parse_mode=ParseMode.HTML
-                    )
+        await self._broadcast_media(
+            context, room, sender_id, message_id, 'photo', file_id, file_path,
+            caption=f"{sender_name}: {caption}" if caption else sender_name,
+            parse_mode=ParseMode.HTML
+        )
 
-    async def _broadcast_video(self, context, room, sender_id, file_path, caption):
+    async def _broadcast_video(self, context, room, sender_id, message_id, file_path, caption, file_id=None):
         """广播视频消息"""
-        sender = await context.bot.get_chat_member(sender_id, sender_id)
-        sender_name = sender.user.first_name
+        sender_name = await self._get_sender_name(context, sender_id)
         
-        for user_id in room.users:
-            if user_id != sender_id:
-                with open(file_path, 'rb') as video:
-                    await context.bot.send_video(
-                        chat_id=user_id,
-                        video=video,
-                        caption=f"{sender_name}: {caption}" if caption else sender_name,
-                        parse_mode=ParseMode.HTML
-                    )
+        await self._broadcast_media(
+            context, room, sender_id, message_id, 'video', file_id, file_path,
+            caption=f"{sender_name}: {caption}" if caption else sender_name,
+            parse_mode=ParseMode.HTML
+        )
 
-    async def _broadcast_document(self, context, room, sender_id, file_path, file_name, caption):
+    async def _broadcast_document(self, context, room, sender_id, message_id, file_path, file_name, caption, file_id=None):
         """广播文件消息"""
-        sender = await context.bot.get_chat_member(sender_id, sender_id)
-        sender_name = sender.user.first_name
+        sender_name = await self._get_sender_name(context, sender_id)
         
-        for user_id in room.users:
-            if user_id != sender_id:
-                with open(file_path, 'rb') as doc:
-                    await context.bot.send_document(
-                        chat_id=user_id,
-                        document=doc,
-                        filename=file_name,
-                        caption=f"{sender_name}: {caption}" if caption else sender_name,
-                        parse_mode=ParseMode.HTML
-                    )
+        await self._broadcast_media(
+            context, room, sender_id, message_id, 'document', file_id, file_path,
+            filename=file_name,
+            caption=f"{sender_name}: {caption}" if caption else sender_name,
+            parse_mode=ParseMode.HTML
+        )
 
-    async def _broadcast_voice(self, context, room, sender_id, file_path, caption):
+    async def _broadcast_voice(self, context, room, sender_id, message_id, file_path, caption, file_id=None):
         """广播语音消息"""
-        sender = await context.bot.get_chat_member(sender_id, sender_id)
-        sender_name = sender.user.first_name
+        sender_name = await self._get_sender_name(context, sender_id)
         
-        for user_id in room.users:
-            if user_id != sender_id:
-                with open(file_path, 'rb') as voice:
-                    await context.bot.send_voice(
-                        chat_id=user_id,
-                        voice=voice,
-                        caption=f"{sender_name}: {caption}" if caption else sender_name,
-                        parse_mode=ParseMode.HTML
-                    )
+        await self._broadcast_media(
+            context, room, sender_id, message_id, 'voice', file_id, file_path,
+            caption=f"{sender_name}: {caption}" if caption else sender_name,
+            parse_mode=ParseMode.HTML
+        )
 
-    async def _broadcast_sticker(self, context, room, sender_id, file_path):
+    async def _broadcast_sticker(self, context, room, sender_id, message_id, file_path, file_id=None):
         """广播贴纸消息"""
-        sender = await context.bot.get_chat_member(sender_id, sender_id)
-        sender_name = sender.user.first_name
-        
-        for user_id in room.users:
-            if user_id != sender_id:
-                with open(file_path, 'rb') as sticker:
-                    await context.bot.send_sticker(
-                        chat_id=user_id,
-                        sticker=sticker
-                    )
+        await self._broadcast_media(
+            context, room, sender_id, message_id, 'sticker', file_id, file_path
+        )
 
-    async def _broadcast_animation(self, context, room, sender_id, file_path, caption):
+    async def _broadcast_animation(self, context, room, sender_id, message_id, file_path, caption, file_id=None):
         """广播GIF动图消息"""
-        sender = await context.bot.get_chat_member(sender_id, sender_id)
-        sender_name = sender.user.first_name
+        sender_name = await self._get_sender_name(context, sender_id)
         
-        for user_id in room.users:
-            if user_id != sender_id:
-                with open(file_path, 'rb') as animation:
-                    await context.bot.send_animation(
-                        chat_id=user_id,
-                        animation=animation,
-                        caption=f"{sender_name}: {caption}" if caption else sender_name,
-                        parse_mode=ParseMode.HTML
-                    )
+        await self._broadcast_media(
+            context, room, sender_id, message_id, 'animation', file_id, file_path,
+            caption=f"{sender_name}: {caption}" if caption else sender_name,
+            parse_mode=ParseMode.HTML
+        )
 
-    def _check_file_type(self, file_path, allowed_types):
-        """检查文件类型是否允许"""
-        mime = magic.Magic(mime=True)
-        file_type = mime.from_file(file_path)
-        return file_type in allowed_types
+    async def _broadcast_media(self, context, room, sender_id, message_id, field, file_id, file_path, **kwargs):
+        """广播媒体消息
+
+        有 file_id 时直接用它发送给所有成员，不再上传文件内容；
+        只有本地文件时，先上传给第一个能收到的成员，再复用返回的 file_id，
+        上传同样遵守出站队列的令牌桶和 RetryAfter 暂停。复用 file_id 的发送都交给出站队列。
+        """
+        method = f"send_{field}"
+        recipients = [user_id for user_id in room.users if user_id != sender_id]
+        while file_id is None and recipients:
+            user_id = recipients.pop(0)
+            try:
+                sent = await self._upload(context, user_id, method, field, file_path, kwargs)
+            except Exception as e:
+                logger.warning(f"Failed to deliver to {user_id}: {e}")
+                room.set_delivery_state(message_id, user_id, STATUS_FAILED)
+                continue
+            room.set_delivery_state(message_id, user_id, STATUS_SENT)
+            file_id = self._get_sent_file_id(sent, field)
+            
+        self.outbox.broadcast(recipients, method, room.room_id, message_id, sender_id=sender_id,
+                              **{field: file_id}, **kwargs)
+
+    async def _upload(self, context, user_id, method, field, file_path, kwargs):
+        """上传本地文件，遇到 RetryAfter 时暂停所有发送并在暂停结束后重试"""
+        while True:
+            await self.outbox.wait_turn()
+            try:
+                with open(file_path, 'rb') as media:
+                    return await getattr(context.bot, method)(chat_id=user_id, **{field: media}, **kwargs)
+            except RetryAfter as e:
+                self.outbox.pause(float(e.retry_after))
+
+    @staticmethod
+    def _get_sent_file_id(sent, field):
+        """从已发送的消息中取出 Telegram file_id"""
+        media = getattr(sent, field)
+        if isinstance(media, (list, tuple)):  # 图片返回多种尺寸，取最大的
+            media = media[-1]
+        return media.file_id
 
     async def _get_file_info(self, file_path):
         """获取文件信息"""
         try:
             file_size = os.path.getsize(file_path)
-            mime = magic.Magic(mime=True)
-            file_type = mime.from_file(file_path)
+            file_type = sniff_file(file_path)
             return {
                 'size': file_size,
                 'type': file_type
             }
         except Exception as e:
             logger.error(f"Failed to get file info: {e}")
-            return None
-
-try:
-    import magic
-except ImportError:
-    import sys
-    if sys.platform == 'win32':
-        print("请安装 python-magic-bin")
-        # pip install python-magic-bin
-    else:
-        print("请安装 python-magic 和系统依赖")
-        # sudo apt-get install libmagic1
-        # pip install python-magic
-    raise
\ No newline at end of file
+            return None
\ No newline at end of file
@@ -0,0 +1,152 @@
+import logging
+import mmap
+import os
+import shutil
+from itertools import islice
+from config import MESSAGE_LOG_DIR, MESSAGE_SEGMENT_SIZE
+from storage import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# 撤回记录的键，消息本身不会包含这个键
+_REMOVED = '$removed'
+
+
+class MessageLog:
+    """聊天室消息的追加写日志
+
+    消息按行写入固定大小的分段文件，编辑时追加新版本，撤回时追加撤回记录，
+    从不改写已有内容。读取通过 mmap 按偏移量直接定位，不需要把历史读入内存。
+    """
+
+    def __init__(self, room_id: str, base_dir: str = MESSAGE_LOG_DIR,
+                 segment_size: int = MESSAGE_SEGMENT_SIZE):
+        self.directory = os.path.join(base_dir, str(room_id))
+        self.segment_size = segment_size
+        self._offsets = {}  # message_id -> (分段号, 偏移量, 长度)，按消息首次写入的顺序排列
+        self._last_id = 0  # 写入过的最大消息 ID，包括已撤回的
+        self._maps = {}  # 分段号 -> mmap
+        self._segment = 0
+        self._file = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._replay()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:08d}.log")
+
+    def _replay(self):
+        """启动时扫描已有分段，重建偏移量索引
+
+        写入中途崩溃或磁盘写满会留下不完整的最后一行，这一行会被截掉，
+        之后的追加仍从完整的行尾开始；无法解析的完整行跳过。
+        """
+        segments = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                          if name.endswith('.log'))
+        for segment in segments:
+            path = self._segment_path(segment)
+            offset = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping corrupt record in {path} at offset {offset}")
+                        offset += len(line)
+                        continue
+                    if _REMOVED in record:
+                        message_id = record[_REMOVED]
+                        self._offsets.pop(message_id, None)
+                    else:
+                        message_id = record['message_id']
+                        self._offsets[message_id] = (segment, offset, len(line))
+                    self._last_id = max(self._last_id, message_id)
+                    offset += len(line)
+            if offset < os.path.getsize(path):
+                logger.warning(f"Truncating incomplete record at the end of {path} (offset {offset})")
+                os.truncate(path, offset)
+        if segments:
+            self._segment = segments[-1]
+        self._file = open(self._segment_path(self._segment), 'ab')
+
+    def _append(self, record: dict):
+        if self._file is None:
+            raise ValueError(f"Message log {self.directory} is closed")
+        data = (dumps(record) + '\n').encode('utf-8')
+        offset = self._file.tell()
+        if offset and offset + len(data) > self.segment_size:
+            self._file.close()
+            self._segment += 1
+            self._file = open(self._segment_path(self._segment), 'ab')
+            offset = 0
+        self._file.write(data)
+        self._file.flush()
+        return self._segment, offset, len(data)
+
+    def write(self, message: dict):
+        """写入新消息或消息的新版本"""
+        # 更新已有键不会改变它在字典中的顺序
+        self._offsets[message['message_id']] = self._append(message)
+        self._last_id = max(self._last_id, message['message_id'])
+
+    def remove(self, message_id: int):
+        """写入撤回记录"""
+        if self._offsets.pop(message_id, None) is not None:
+            self._append({_REMOVED: message_id})
+
+    def _map(self, segment: int, end: int):
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < end:
+            if mapped is not None:
+                mapped.close()
+            with open(self._segment_path(segment), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return mapped
+
+    def read(self, message_id: int):
+        """读取消息，不存在返回 None"""
+        location = self._offsets.get(message_id)
+        if location is None:
+            return None
+        segment, offset, length = location
+        return loads(self._map(segment, offset + length)[offset:offset + length])
+
+    @property
+    def last_id(self) -> int:
+        """写入过的最大消息 ID（撤回的消息也算），重启后新消息的 ID 从它之后分配"""
+        return self._last_id
+
+    def message_ids(self) -> list:
+        """按写入顺序返回所有未撤回的消息 ID"""
+        return list(self._offsets)
+
+    def recent_ids(self, limit: int) -> list:
+        """从新到旧返回最近 limit 条消息的 ID"""
+        return list(islice(reversed(self._offsets), limit))
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def destroy(self):
+        """关闭并删除所有分段文件"""
+        self.close()
+        self._offsets.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @staticmethod
+    def remove_files(room_id: str, base_dir: str = MESSAGE_LOG_DIR):
+        """直接删除聊天室的日志目录，不需要先打开和重放日志"""
+        shutil.rmtree(os.path.join(base_dir, str(room_id)), ignore_errors=True)
+
+    def __contains__(self, message_id) -> bool:
+        return message_id in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
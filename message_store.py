@@ -0,0 +1,243 @@
+import sys
+import time
+from itertools import islice
+from datetime import datetime
+from config import MESSAGE_TAIL_SIZE
+
+# 以 datetime 形式对外提供的时间字段，内部保存为时间戳
+_TIME_FIELDS = ('timestamp', 'last_edit_time')
+# 只有编辑过的消息才有的字段
+_EDIT_FIELDS = ('edited', 'last_edit_time')
+
+
+class MessageRecord:
+    """聊天室消息记录
+
+    使用 __slots__ 代替每条消息一个 dict，消息类型字符串做了 intern，
+    时间保存为时间戳。同时支持 msg['content']、msg.get('type') 等 dict 写法，
+    其中时间字段以 datetime 返回。
+    """
+
+    __slots__ = ('message_id', 'user_id', 'type', 'content', 'timestamp',
+                 'edited', 'last_edit_time')
+
+    def __init__(self, message_id: int, user_id: int, message_type: str, content,
+                 timestamp: float = None, edited: bool = False, last_edit_time: float = None):
+        self.message_id = message_id
+        self.user_id = user_id
+        self.type = sys.intern(message_type)
+        self.content = content
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.edited = edited
+        self.last_edit_time = last_edit_time
+
+    def _has(self, key) -> bool:
+        return key in self.__slots__ and (self.edited or key not in _EDIT_FIELDS)
+
+    def __getitem__(self, key):
+        if not self._has(key):
+            raise KeyError(key)
+        value = getattr(self, key)
+        if key in _TIME_FIELDS and value is not None:
+            return datetime.fromtimestamp(value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        if key in _TIME_FIELDS and isinstance(value, datetime):
+            value = value.timestamp()
+        elif key == 'type':
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> list:
+        return [key for key in self.__slots__ if self._has(key)]
+
+    def items(self) -> list:
+        return [(key, self[key]) for key in self.keys()]
+
+    def __contains__(self, key) -> bool:
+        return self._has(key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def to_dict(self) -> dict:
+        """转换为普通 dict（时间字段为 datetime）"""
+        return dict(self.items())
+
+    def to_state(self) -> dict:
+        """转换为用于持久化的 dict（时间字段为时间戳）"""
+        state = {
+            'message_id': self.message_id,
+            'user_id': self.user_id,
+            'type': self.type,
+            'content': self.content,
+            'timestamp': self.timestamp
+        }
+        if self.edited:
+            state['edited'] = True
+            state['last_edit_time'] = self.last_edit_time
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """从持久化的 dict 恢复"""
+        return cls(state['message_id'], state['user_id'], state['type'], state['content'],
+                   state['timestamp'], state.get('edited', False), state.get('last_edit_time'))
+
+    def __eq__(self, other):
+        if isinstance(other, MessageRecord):
+            return self.to_state() == other.to_state()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"MessageRecord({self.to_dict()!r})"
+
+
+class MessageIdAllocator:
+    """单调递增的消息 ID 分配器，撤回后也不会复用 ID"""
+
+    def __init__(self, start: int = 1):
+        self._next = start
+
+    def next_id(self) -> int:
+        """分配下一个消息 ID"""
+        message_id = self._next
+        self._next += 1
+        return message_id
+
+    @property
+    def last_id(self) -> int:
+        """最近一次分配的 ID，尚未分配时为 0"""
+        return self._next - 1
+
+    def advance(self, message_id: int):
+        """确保之后分配的 ID 大于 message_id（用于恢复已有消息）"""
+        if message_id >= self._next:
+            self._next = message_id + 1
+
+
+class MessageStore:
+    """聊天室消息存储
+
+    消息按 message_id 保存在按插入顺序排列的 dict 中，
+    查找、撤回、编辑都是 O(1)，不随历史长度增长。
+
+    接入 MessageLog 后消息同时写入磁盘日志，内存中只保留最近 tail_size 条，
+    更早的消息按需从日志读取，消息顺序和是否已撤回以日志的索引为准。
+    """
+
+    def __init__(self, log=None, tail_size: int = MESSAGE_TAIL_SIZE):
+        self.log = log
+        self.tail_size = tail_size
+        self._messages = {}  # 保留在内存中的消息 message_id -> MessageRecord
+        self._ids = MessageIdAllocator()
+        if log is not None:
+            # 以日志中出现过的最大 ID 为准，最新的几条消息被撤回后重启也不会复用它们的 ID
+            self._ids.advance(log.last_id)
+
+    def next_id(self) -> int:
+        """分配新的消息 ID"""
+        return self._ids.next_id()
+
+    @property
+    def last_id(self) -> int:
+        """最近分配的消息 ID"""
+        return self._ids.last_id
+
+    def advance_id(self, message_id: int):
+        """保证之后分配的 ID 大于 message_id"""
+        self._ids.advance(message_id)
+
+    def append(self, message: MessageRecord):
+        """追加消息"""
+        self._ids.advance(message.message_id)
+        self._messages[message.message_id] = message
+        if self.log is not None:
+            self.log.write(message.to_state())
+            while len(self._messages) > self.tail_size:
+                del self._messages[next(iter(self._messages))]
+
+    def update(self, message: MessageRecord):
+        """保存对已有消息的修改"""
+        if message.message_id not in self:
+            return
+        if message.message_id in self._messages:
+            self._messages[message.message_id] = message
+        if self.log is not None:
+            self.log.write(message.to_state())
+
+    def get(self, message_id: int):
+        """按 ID 获取消息，不存在返回 None"""
+        message = self._messages.get(message_id)
+        if message is None and self.log is not None:
+            state = self.log.read(message_id)
+            if state is not None:
+                message = MessageRecord.from_state(state)
+        return message
+
+    def remove(self, message_id: int) -> bool:
+        """删除消息"""
+        if message_id not in self:
+            return False
+        self._messages.pop(message_id, None)
+        if self.log is not None:
+            self.log.remove(message_id)
+        return True
+
+    def recent(self, limit: int) -> list:
+        """获取最近的 limit 条消息"""
+        if limit <= 0:
+            return []
+        if self.log is not None:
+            message_ids = self.log.recent_ids(limit)
+        else:
+            message_ids = list(islice(reversed(self._messages), limit))
+        return [self.get(message_id) for message_id in reversed(message_ids)]
+
+    def iter_after(self, message_id: int = 0):
+        """按 ID 顺序逐条读取 message_id 之后的消息，不生成完整的 ID 列表
+
+        迭代过程中新追加的消息也会被读到。
+        """
+        while message_id < self.last_id:
+            message_id += 1
+            message = self.get(message_id)
+            if message is not None:
+                yield message
+
+    def clear(self):
+        """清空所有消息"""
+        self._messages.clear()
+        if self.log is not None:
+            self.log.destroy()
+
+    def __contains__(self, message_id) -> bool:
+        if self.log is not None:
+            return message_id in self.log
+        return message_id in self._messages
+
+    def __len__(self) -> int:
+        if self.log is not None:
+            return len(self.log)
+        return len(self._messages)
+
+    def __iter__(self):
+        if self.log is not None:
+            message_ids = self.log.message_ids()
+        else:
+            message_ids = list(self._messages)
+        return (self.get(message_id) for message_id in message_ids)
@@ -0,0 +1,100 @@
+import threading
+import httpx
+import magic
+from config import MIME_SNIFF_BYTES, MAX_FILE_SIZE, CONNECTION_POOL_SIZE
+
+CHUNK_SIZE = 64 * 1024
+
+_local = threading.local()
+_http_client = None
+_http_settings = {}  # 由 configure_http_client 设置，与 Bot API 请求使用相同的代理和超时
+
+
+class UnsupportedFileType(Exception):
+    """文件类型不在允许的列表中"""
+
+    def __init__(self, mime_type: str):
+        super().__init__(f"Unsupported file type: {mime_type}")
+        self.mime_type = mime_type
+
+
+def get_magic():
+    """获取当前线程的 libmagic 句柄，每个线程只创建一次"""
+    handle = getattr(_local, 'magic', None)
+    if handle is None:
+        handle = magic.Magic(mime=True)
+        _local.magic = handle
+    return handle
+
+
+def sniff_bytes(data: bytes) -> str:
+    """根据文件开头的字节判断 MIME 类型"""
+    return get_magic().from_buffer(data)
+
+
+def sniff_file(path: str) -> str:
+    """判断本地文件的 MIME 类型，只读取文件开头"""
+    with open(path, 'rb') as f:
+        return sniff_bytes(f.read(MIME_SNIFF_BYTES))
+
+
+def configure_http_client(proxy_url: str = None, connect_timeout: float = 60.0,
+                          read_timeout: float = 60.0, pool_size: int = CONNECTION_POOL_SIZE):
+    """设置下载连接池的代理、超时和连接数，应与 bot 的 HTTPXRequest 保持一致
+
+    需要在第一次下载之前调用。
+    """
+    _http_settings.update(
+        proxies=proxy_url,
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的下载连接池"""
+    global _http_client
+    if _http_client is None:
+        if not _http_settings:
+            configure_http_client()
+        _http_client = httpx.AsyncClient(**_http_settings)
+    return _http_client
+
+
+async def close_http_client():
+    """关闭下载连接池"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def stream_download(url: str, dest: str, allowed_types=None) -> str:
+    """流式下载文件并在写盘前检查类型
+
+    先只读取开头 MIME_SNIFF_BYTES 字节判断类型，不允许的类型直接关闭响应并抛出
+    UnsupportedFileType，不会下载其余部分；允许的类型再把剩余内容分块写入 dest。
+    返回文件的 MIME 类型。
+    """
+    async with get_http_client().stream('GET', url) as response:
+        if response.status_code != 200:
+            raise IOError(f"Download failed with HTTP {response.status_code}")
+        chunks = response.aiter_bytes(CHUNK_SIZE)
+        head = b''
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= MIME_SNIFF_BYTES:
+                break
+        mime_type = sniff_bytes(head[:MIME_SNIFF_BYTES])
+        if allowed_types is not None and mime_type not in allowed_types:
+            raise UnsupportedFileType(mime_type)
+
+        written = len(head)
+        with open(dest, 'wb') as f:
+            f.write(head)
+            async for chunk in chunks:
+                written += len(chunk)
+                if written > MAX_FILE_SIZE:
+                    raise IOError("File exceeds MAX_FILE_SIZE")
+                f.write(chunk)
+    return mime_type
@@ -0,0 +1,90 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ModerationEngine:
+    """批量管理用户
+
+    通过成员关系索引直接找到用户所在的聊天室，不遍历所有聊天室，
+    一次调用处理一批用户，最后返回处理结果和耗时。
+    """
+
+    def __init__(self, chat_rooms: dict, user_manager, outbox=None):
+        self.chat_rooms = chat_rooms
+        self.user_manager = user_manager
+        self.outbox = outbox
+
+    def ban_users(self, user_ids) -> dict:
+        """在所有聊天室中封禁用户
+
+        用户被全局封禁并移出所在的所有聊天室（聊天室创建者除外），
+        发给他们的和他们发出、还没转发完的消息都被取消。
+        """
+        started = time.monotonic()
+        users = set(user_ids)
+        rooms = set()
+        evicted = 0
+        skipped = 0
+        cancelled = 0
+        for user_id in users:
+            for room_id in list(self.user_manager.get_user_rooms(user_id)):
+                room = self.chat_rooms.get(room_id)
+                if room is None:
+                    # 聊天室已经不存在，只清理成员关系
+                    self.user_manager.membership.remove(user_id, room_id)
+                    continue
+                if user_id == room.creator_id:
+                    skipped += 1
+                    continue
+                room.ban_user(user_id)
+                rooms.add(room_id)
+                evicted += 1
+            self.user_manager.ban_user(user_id)
+            if self.outbox is not None:
+                cancelled += self.outbox.cancel(user_id) + self.outbox.cancel_from(user_id)
+        return self._report('ban', {
+            'users': len(users),
+            'rooms': len(rooms),
+            'evicted': evicted,
+            'skipped': skipped,
+            'cancelled': cancelled
+        }, started)
+
+    def mute_users(self, user_ids, room_ids=None) -> dict:
+        """禁言用户，保留成员身份
+
+        room_ids 为 None 时在用户所在的所有聊天室禁言，否则只在指定的聊天室中禁言。
+        """
+        started = time.monotonic()
+        users = set(user_ids)
+        limit = set(room_ids) if room_ids is not None else None
+        rooms = set()
+        muted = 0
+        skipped = 0
+        for user_id in users:
+            for room_id in list(self.user_manager.get_user_rooms(user_id)):
+                if limit is not None and room_id not in limit:
+                    continue
+                room = self.chat_rooms.get(room_id)
+                if room is None:
+                    continue
+                if user_id == room.creator_id:
+                    skipped += 1
+                    continue
+                room.mute_user(user_id)
+                rooms.add(room_id)
+                muted += 1
+        return self._report('mute', {
+            'users': len(users),
+            'rooms': len(rooms),
+            'muted': muted,
+            'skipped': skipped
+        }, started)
+
+    @staticmethod
+    def _report(action: str, summary: dict, started: float) -> dict:
+        summary['duration'] = time.monotonic() - started
+        logger.info(f"Bulk {action}: " + ', '.join(f"{key}={value}" for key, value in summary.items()))
+        return summary
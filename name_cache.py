@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+from config import NAME_CACHE_TTL, NAME_CACHE_SIZE
+
+
+class NameCache:
+    """用户昵称缓存（LRU + 过期时间）
+
+    优先用 update.effective_user 填充，避免每次广播都调用 get_chat_member。
+    """
+
+    def __init__(self, ttl: int = NAME_CACHE_TTL, max_size: int = NAME_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # 用户ID -> (昵称, 过期时间)
+
+    def get(self, user_id: int):
+        """获取缓存的昵称，不存在或已过期返回 None"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        name, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return name
+
+    def set(self, user_id: int, name: str):
+        """写入昵称"""
+        self._entries[user_id] = (name, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def update_from_user(self, user) -> bool:
+        """用 Telegram User 对象刷新昵称，昵称有变化时返回 True"""
+        if user is None:
+            return False
+        entry = self._entries.get(user.id)
+        changed = entry is None or entry[0] != user.first_name
+        self.set(user.id, user.first_name)
+        return changed
+
+    def invalidate(self, user_id: int):
+        """使缓存失效"""
+        self._entries.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# 全局共享的昵称缓存
+name_cache = NameCache()
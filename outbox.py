@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
+from config import (
+    FANOUT_CONCURRENCY, TELEGRAM_RATE_LIMIT, OUTBOX_MAX_RETRIES,
+    OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX_DELAY, TEXT_BATCH_WINDOW, MAX_MESSAGE_LENGTH
+)
+from fanout import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# 投递状态
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+
+class OutboundJob:
+    """一次待发送的 Bot API 调用"""
+
+    __slots__ = ('job_id', 'chat_id', 'method', 'kwargs', 'room_id', 'message_id', 'attempts', 'batch',
+                 'sender_id')
+
+    def __init__(self, chat_id: int, method: str, kwargs: dict, room_id=None,
+                 message_id: int = None, job_id: str = None, attempts: int = 0,
+                 batch: bool = False, sender_id: int = None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.room_id = room_id
+        self.message_id = message_id
+        self.attempts = attempts
+        self.batch = batch  # 是否可以和相邻的文本消息合并发送
+        self.sender_id = sender_id  # 转发的是谁发的消息，机器人自己的通知为 None
+
+    def to_state(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    @classmethod
+    def from_state(cls, state: dict):
+        return cls(state['chat_id'], state['method'], state['kwargs'], state['room_id'],
+                   state['message_id'], state['job_id'], state['attempts'],
+                   state.get('batch', False), state.get('sender_id'))
+
+
+class Outbox:
+    """出站消息队列
+
+    每个接收者一个 FIFO 队列，由固定数量的 worker 轮流发送，同一接收者的消息保持顺序。
+    网络错误按带抖动的指数退避重试，收到 RetryAfter 时所有发送暂停指定的时间，
+    用户屏蔽机器人等永久错误直接标记失败，不影响其他接收者。
+    标记为 batch 的文本消息会等待 TEXT_BATCH_WINDOW 秒，同一接收者的连续文本合并成一次发送。
+    待发送的任务写入存储后端，重启后继续发送。
+    """
+
+    def __init__(self, chat_rooms: dict = None, storage=None, workers: int = FANOUT_CONCURRENCY,
+                 rate_limiter: TokenBucket = None):
+        self.chat_rooms = chat_rooms if chat_rooms is not None else {}
+        self.storage = storage
+        self.workers = workers
+        self.rate_limiter = rate_limiter or TokenBucket(TELEGRAM_RATE_LIMIT)
+        self.bot = None
+        self._queues = {}  # chat_id -> 待发送任务队列
+        self._scheduled = set()  # 已在等待或正在被 worker 处理的 chat_id
+        self._ready = deque()  # 可以发送的 chat_id
+        self._sending = {}  # 正在被 worker 处理的 chat_id -> 正在发送的任务数
+        self._wakeup = None
+        self._tasks = []
+        self._paused_until = 0.0
+
+    def start(self, bot):
+        """启动 worker，并恢复上次未发送完的任务（重复调用无效果）"""
+        if self.bot is not None:
+            return
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        if self.storage is not None:
+            for state in self.storage.load_outbox():
+                self._push(OutboundJob.from_state(state))
+
+    async def stop(self):
+        """停止 worker，未发送的任务保留在存储中"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.bot = None
+
+    def enqueue(self, chat_id: int, method: str, room_id=None, message_id: int = None,
+                batch: bool = False, sender_id: int = None, **kwargs) -> OutboundJob:
+        """加入一个发送任务，kwargs 为 Bot API 方法的参数（需可 JSON 序列化）"""
+        job = OutboundJob(chat_id, method, kwargs, room_id, message_id, batch=batch, sender_id=sender_id)
+        if self.storage is not None:
+            self.storage.save_outbox_job(job.job_id, job.to_state())
+        self._set_state(job, STATUS_PENDING)
+        self._push(job, TEXT_BATCH_WINDOW if batch else 0)
+        return job
+
+    def broadcast(self, recipients, method: str, room_id=None, message_id: int = None,
+                  batch: bool = False, sender_id: int = None, **kwargs):
+        """向多个接收者发送同样的内容"""
+        return [self.enqueue(chat_id, method, room_id, message_id, batch, sender_id, **kwargs)
+                for chat_id in recipients]
+
+    def cancel(self, chat_id: int) -> int:
+        """取消发给接收者的所有待发送任务，返回取消的数量（正在发送的那一条不受影响）"""
+        queue = self._queues.get(chat_id)
+        if not queue:
+            return 0
+        keep = self._sending.get(chat_id, 0)
+        cancelled = 0
+        while len(queue) > keep:
+            self._cancel_job(queue.pop())
+            cancelled += 1
+        return cancelled
+
+    def cancel_from(self, sender_id: int) -> int:
+        """取消所有转发 sender_id 消息的待发送任务，返回取消的数量（正在发送的不受影响）"""
+        cancelled = 0
+        for chat_id, queue in self._queues.items():
+            keep = self._sending.get(chat_id, 0)
+            if not any(job.sender_id == sender_id for job in islice(queue, keep, None)):
+                continue
+            remaining = deque(islice(queue, keep))
+            for job in islice(queue, keep, None):
+                if job.sender_id == sender_id:
+                    self._cancel_job(job)
+                    cancelled += 1
+                else:
+                    remaining.append(job)
+            # worker 持有的是同一个 deque 对象，原地替换内容
+            queue.clear()
+            queue.extend(remaining)
+        return cancelled
+
+    def _cancel_job(self, job: OutboundJob):
+        if self.storage is not None:
+            self.storage.delete_outbox_job(job.job_id)
+        self._set_state(job, STATUS_CANCELLED)
+
+    async def wait_turn(self):
+        """等到限流暂停结束并取得发送令牌，直接调用 Bot API 的发送也要先调用它"""
+        while True:
+            wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self.rate_limiter.acquire()
+
+    def pause(self, retry_after: float):
+        """收到 RetryAfter 后暂停所有发送"""
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        logger.warning(f"Flood control exceeded, pausing sends for {retry_after}s")
+
+    def pending(self, chat_id: int) -> int:
+        """接收者待发送的任务数"""
+        return len(self._queues.get(chat_id, ()))
+
+    def _push(self, job: OutboundJob, delay: float = 0):
+        self._queues.setdefault(job.chat_id, deque()).append(job)
+        self._schedule(job.chat_id, delay)
+
+    def _schedule(self, chat_id: int, delay: float = 0):
+        if chat_id in self._scheduled:
+            return
+        self._scheduled.add(chat_id)
+        if delay > 0:
+            asyncio.get_event_loop().call_later(delay, self._make_ready, chat_id)
+        else:
+            self._make_ready(chat_id)
+
+    def _make_ready(self, chat_id: int):
+        self._ready.append(chat_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            while not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            chat_id = self._ready.popleft()
+            self._sending[chat_id] = 0
+            try:
+                delay = await self._drain(chat_id)
+            except Exception as e:
+                logger.error(f"Outbox worker failed for {chat_id}: {e}")
+                delay = OUTBOX_RETRY_BASE
+            finally:
+                self._sending.pop(chat_id, None)
+            self._scheduled.discard(chat_id)
+            if self._queues.get(chat_id):
+                self._schedule(chat_id, delay)
+            else:
+                self._queues.pop(chat_id, None)
+
+    async def _drain(self, chat_id: int) -> float:
+        """依次发送接收者队列中的任务，需要稍后重试时返回等待的秒数"""
+        queue = self._queues.get(chat_id)
+        while queue:
+            wait = self._paused_until - time.monotonic()
+            if wait > 0:
+                return wait
+            job = queue[0]
+            count, kwargs = self._merge(queue)
+            self._sending[chat_id] = count
+            await self.rate_limiter.acquire()
+            try:
+                await getattr(self.bot, job.method)(chat_id=job.chat_id, **kwargs)
+            except RetryAfter as e:
+                # 触发了 Telegram 的限流，所有发送一起暂停
+                retry_after = float(e.retry_after)
+                self.pause(retry_after)
+                return retry_after
+            except (Forbidden, BadRequest) as e:
+                logger.warning(f"Failed to deliver to {chat_id}: {e}")
+                self._finish(queue, STATUS_FAILED, count)
+            except NetworkError as e:
+                job.attempts += 1
+                if job.attempts > OUTBOX_MAX_RETRIES:
+                    logger.warning(f"Giving up delivery to {chat_id} after {job.attempts} attempts: {e}")
+                    self._finish(queue, STATUS_FAILED, count)
+                    continue
+                if self.storage is not None:
+                    self.storage.save_outbox_job(job.job_id, job.to_state())
+                return self._backoff(job.attempts)
+            except Exception as e:
+                logger.error(f"Failed to deliver to {chat_id}: {e}")
+                self._finish(queue, STATUS_FAILED, count)
+            else:
+                self._finish(queue, STATUS_SENT, count)
+        return 0
+
+    @staticmethod
+    def _merge(queue: deque):
+        """合并队列开头可以一起发送的文本消息，返回 (合并的任务数, 发送参数)
+
+        只合并来自同一聊天室、参数相同的文本，不同聊天室的消息不会拼成一条
+        """
+        first = queue[0]
+        if not first.batch or first.method != 'send_message':
+            return 1, first.kwargs
+        texts = [first.kwargs['text']]
+        length = len(texts[0])
+        others = dict(first.kwargs, text=None)
+        for job in islice(queue, 1, None):
+            if (not job.batch or job.method != first.method or job.room_id != first.room_id
+                    or dict(job.kwargs, text=None) != others):
+                break
+            length += 1 + len(job.kwargs['text'])
+            if length > MAX_MESSAGE_LENGTH:
+                break
+            texts.append(job.kwargs['text'])
+        if len(texts) == 1:
+            return 1, first.kwargs
+        return len(texts), dict(first.kwargs, text='\n'.join(texts))
+
+    @staticmethod
+    def _backoff(attempts: int) -> float:
+        """带抖动的指数退避"""
+        delay = min(OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETRY_BASE * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _finish(self, queue: deque, status: str, count: int = 1):
+        for _ in range(count):
+            job = queue.popleft()
+            if self.storage is not None:
+                self.storage.delete_outbox_job(job.job_id)
+            self._set_state(job, status)
+
+    def _set_state(self, job: OutboundJob, status: str):
+        if job.message_id is None:
+            return
+        room = self.chat_rooms.get(job.room_id)
+        if room is not None:
+            room.set_delivery_state(job.message_id, job.chat_id, status)
@@ -0,0 +1,52 @@
+import time
+from collections import OrderedDict
+from config import ONLINE_TIMEOUT
+
+
+class PresenceTracker:
+    """在线状态跟踪
+
+    用户按最后活动时间排列在 OrderedDict 中，最早活动的在最前面，所有人超时时间相同，
+    所以这也是按过期时间排好的顺序。过期的用户只需要从头部依次弹出，
+    判断是否在线、统计在线人数都不需要遍历所有用户。
+    """
+
+    def __init__(self, timeout: float = ONLINE_TIMEOUT):
+        self.timeout = timeout
+        self._last_seen = OrderedDict()  # 用户ID -> 最后活动时间（monotonic）
+
+    def touch(self, user_id: int):
+        """记录用户活动"""
+        self._last_seen[user_id] = time.monotonic()
+        self._last_seen.move_to_end(user_id)
+        self._expire()
+
+    def discard(self, user_id: int):
+        """用户离开后立即标记为离线"""
+        self._last_seen.pop(user_id, None)
+
+    def is_online(self, user_id: int) -> bool:
+        """用户是否在线"""
+        last_seen = self._last_seen.get(user_id)
+        return last_seen is not None and time.monotonic() - last_seen < self.timeout
+
+    def online_users(self) -> list:
+        """在线用户，按最后活动时间从早到晚排列"""
+        self._expire()
+        return list(self._last_seen)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.timeout
+        while self._last_seen:
+            user_id, last_seen = next(iter(self._last_seen.items()))
+            if last_seen > deadline:
+                break
+            del self._last_seen[user_id]
+
+    def __len__(self) -> int:
+        """在线人数"""
+        self._expire()
+        return len(self._last_seen)
+
+    def __contains__(self, user_id) -> bool:
+        return self.is_online(user_id)
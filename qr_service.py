@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import qrcode
+from config import BOT_USERNAME, QR_CODES_DIR, QR_CACHE_SIZE, QR_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+def render_qr_png(data: str) -> bytes:
+    """生成二维码 PNG（在子进程中运行）"""
+    image = qrcode.make(data)
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def join_link(room_id: str) -> str:
+    """聊天室的加入链接"""
+    return f"https://t.me/{BOT_USERNAME}?start={room_id}"
+
+
+class QRService:
+    """聊天室二维码服务
+
+    二维码在进程池中生成，不占用事件循环。生成结果按链接缓存：
+    内存中保留最近使用的 max_size 个，磁盘上保存在 QR_CODES_DIR，重启后不必重新生成。
+    同一链接同时多次请求只生成一次。聊天室过期后调用 evict_room 删除缓存。
+    """
+
+    def __init__(self, cache_dir: str = QR_CODES_DIR, max_size: int = QR_CACHE_SIZE,
+                 workers: int = QR_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.workers = workers
+        self._cache = OrderedDict()  # 链接 -> PNG 内容
+        self._pending = {}  # 链接 -> 正在生成的任务
+        self._executor = None
+
+    def _disk_path(self, link: str) -> str:
+        return os.path.join(self.cache_dir, f"{hashlib.sha1(link.encode('utf-8')).hexdigest()}.png")
+
+    async def get_room_qr(self, room_id: str) -> bytes:
+        """获取聊天室加入链接的二维码"""
+        return await self.get(join_link(room_id))
+
+    async def get(self, link: str) -> bytes:
+        """获取链接的二维码 PNG"""
+        png = self._cache.get(link)
+        if png is not None:
+            self._cache.move_to_end(link)
+            return png
+        task = self._pending.get(link)
+        if task is None:
+            task = asyncio.ensure_future(self._load(link))
+            self._pending[link] = task
+            task.add_done_callback(lambda _: self._pending.pop(link, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, link: str) -> bytes:
+        path = self._disk_path(link)
+        try:
+            with open(path, 'rb') as f:
+                png = f.read()
+        except FileNotFoundError:
+            if self._executor is None:
+                # 这时已经有存储写入线程和事件循环在运行，fork 会继承它们持有的锁，改用 spawn
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            loop = asyncio.get_running_loop()
+            png = await loop.run_in_executor(self._executor, render_qr_png, link)
+            self._write(path, png)
+        self._remember(link, png)
+        return png
+
+    def _write(self, path: str, png: bytes):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            partial = f"{path}.part"
+            with open(partial, 'wb') as f:
+                f.write(png)
+            os.replace(partial, path)
+        except OSError as e:
+            logger.warning(f"Failed to cache QR code {path}: {e}")
+
+    def _remember(self, link: str, png: bytes):
+        self._cache[link] = png
+        self._cache.move_to_end(link)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def evict(self, link: str):
+        """删除链接的二维码缓存（内存和磁盘）"""
+        self._cache.pop(link, None)
+        try:
+            os.remove(self._disk_path(link))
+        except FileNotFoundError:
+            pass
+
+    def evict_room(self, room_id: str):
+        """聊天室关闭后删除它的二维码，可以作为 RoomCleaner 的 release hook"""
+        self.evict(join_link(room_id))
+
+    def close(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
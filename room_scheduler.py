@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from collections import deque
+from config import ROOM_QUEUE_SIZE, ROOM_QUEUE_OVERFLOW
+
+logger = logging.getLogger(__name__)
+
+# 聊天室队列满时的处理方式
+OVERFLOW_REJECT = 'reject'  # 拒绝新任务并抛出 RoomQueueFull
+OVERFLOW_DROP_NEWEST = 'drop_newest'  # 丢弃新任务
+OVERFLOW_DROP_OLDEST = 'drop_oldest'  # 丢弃最早排队的任务
+
+
+class RoomQueueFull(Exception):
+    """聊天室待处理任务过多"""
+
+    def __init__(self, room_id):
+        super().__init__(f"Work queue for room {room_id} is full")
+        self.room_id = room_id
+
+
+class RoomScheduler:
+    """按聊天室分片的任务调度
+
+    同一个聊天室的任务按提交顺序依次执行，不同聊天室的任务并行执行，
+    一个聊天室在广播大文件时不会挡住其他聊天室。每个聊天室最多排队 max_backlog 个任务。
+
+    submit 提交后立即返回，调用方（包括 webhook 的 worker）感受不到任务的执行时间，
+    积压由这里的队列长度限制。任务抛出的异常只记录日志，需要交给 application 错误处理的
+    任务应自己捕获并调用 application.process_error。
+    """
+
+    def __init__(self, max_backlog: int = ROOM_QUEUE_SIZE, overflow: str = ROOM_QUEUE_OVERFLOW):
+        self.max_backlog = max_backlog
+        self.overflow = overflow
+        self._queues = {}  # room_id -> 待执行任务队列
+        self._workers = {}  # room_id -> 正在执行该聊天室任务的协程
+
+    def submit(self, room_id, job) -> bool:
+        """提交任务，job 为无参数、返回协程的函数
+
+        队列已满且策略为 drop_newest 时返回 False
+        """
+        queue = self._queues.setdefault(room_id, deque())
+        if len(queue) >= self.max_backlog:
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                queue.popleft()
+                logger.warning(f"Room {room_id} backlog full, dropped oldest job")
+            elif self.overflow == OVERFLOW_DROP_NEWEST:
+                logger.warning(f"Room {room_id} backlog full, dropped new job")
+                return False
+            else:
+                raise RoomQueueFull(room_id)
+        queue.append(job)
+        if room_id not in self._workers:
+            self._workers[room_id] = asyncio.ensure_future(self._drain(room_id))
+        return True
+
+    async def _drain(self, room_id):
+        queue = self._queues[room_id]
+        try:
+            while queue:
+                job = queue.popleft()
+                try:
+                    await job()
+                except Exception as e:
+                    logger.error(f"Job for room {room_id} failed: {e}")
+        finally:
+            del self._workers[room_id]
+            if not queue:
+                self._queues.pop(room_id, None)
+
+    def backlog(self, room_id) -> int:
+        """聊天室中排队等待的任务数"""
+        return len(self._queues.get(room_id, ()))
+
+    async def join(self):
+        """等待所有已提交的任务执行完"""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
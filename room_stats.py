@@ -0,0 +1,62 @@
+from collections import Counter
+from datetime import datetime
+from config import STATS_HOURS
+
+# 统计中始终列出的消息类型
+MESSAGE_TYPES = ('text', 'photo', 'video', 'document', 'voice', 'sticker', 'animation')
+
+
+class RoomStats:
+    """聊天室消息统计计数器
+
+    按消息类型、发送者和小时累计消息数，添加和撤回消息时 O(1) 更新，
+    查询统计时直接读取计数，不再遍历聊天记录。小时统计只保留最近 hours 小时。
+    """
+
+    def __init__(self, hours: int = STATS_HOURS):
+        self.hours = hours
+        self.total = 0
+        self.by_type = Counter()
+        self.by_user = Counter()
+        self.by_hour = {}  # 整点的时间戳 // 3600 -> 消息数
+
+    def add(self, message):
+        """计入一条消息"""
+        self.total += 1
+        self.by_type[message.type] += 1
+        self.by_user[message.user_id] += 1
+        hour = int(message.timestamp // 3600)
+        if hour not in self.by_hour:
+            # 出现新的小时时顺便丢弃过旧的统计
+            oldest = hour - self.hours
+            for stale in [h for h in self.by_hour if h <= oldest]:
+                del self.by_hour[stale]
+            self.by_hour[hour] = 0
+        self.by_hour[hour] += 1
+
+    def remove(self, message):
+        """撤回消息后减去它的计数"""
+        self.total -= 1
+        self._decrement(self.by_type, message.type)
+        self._decrement(self.by_user, message.user_id)
+        hour = int(message.timestamp // 3600)
+        if hour in self.by_hour:
+            self.by_hour[hour] -= 1
+
+    @staticmethod
+    def _decrement(counter: Counter, key):
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+
+    def snapshot(self) -> dict:
+        """当前统计的副本"""
+        message_types = dict.fromkeys(MESSAGE_TYPES, 0)
+        message_types.update(self.by_type)
+        return {
+            'total_messages': self.total,
+            'message_types': message_types,
+            'user_messages': dict(self.by_user.most_common()),
+            'hourly_activity': [(datetime.fromtimestamp(hour * 3600), count)
+                                for hour, count in sorted(self.by_hour.items())]
+        }
@@ -0,0 +1,136 @@
+import heapq
+import math
+import re
+from collections import Counter
+from config import SEARCH_PAGE_SIZE
+
+# 连续的中日韩字符，或连续的字母数字
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(rf'([{_CJK}]+)|([^\W_{_CJK}]+)')
+_CJK_CHAR_RE = re.compile(rf'[{_CJK}]')
+
+
+def tokenize(text: str) -> list:
+    """分词：中日韩文本切成相邻两字的二元组（单字保留原样），其他文字按整词切分"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(text.lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def message_text(message) -> str:
+    """取出消息中可搜索的文字：文本内容、媒体的说明和文件名"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    if isinstance(content, dict):
+        return ' '.join(str(content[key]) for key in ('file_name', 'caption') if content.get(key))
+    return ''
+
+
+class SearchIndex:
+    """聊天室消息的倒排索引
+
+    每个词对应包含它的消息及词频，增删改只涉及消息自身的词。
+    查询时从最少见的词开始求交集，按 tf-idf 打分，只对需要的那一页做部分排序。
+    另外记录每个汉字出现在哪些二元组中，单字查询不需要遍历整个词表。
+    """
+
+    def __init__(self):
+        self._postings = {}  # 词 -> {message_id: 词频}
+        self._documents = {}  # message_id -> 消息的词频 Counter
+        self._bigrams = {}  # 汉字 -> {包含它的二元组: None}
+
+    @staticmethod
+    def _is_bigram(term: str) -> bool:
+        return len(term) == 2 and _CJK_CHAR_RE.match(term) is not None
+
+    def add(self, message_id: int, text: str):
+        """索引一条消息"""
+        terms = Counter(tokenize(text))
+        if not terms:
+            return
+        self._documents[message_id] = terms
+        for term, count in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                if self._is_bigram(term):
+                    for char in set(term):
+                        self._bigrams.setdefault(char, {})[term] = None
+            postings[message_id] = count
+
+    def remove(self, message_id: int):
+        """从索引中删除消息"""
+        terms = self._documents.pop(message_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[message_id]
+            if not postings:
+                del self._postings[term]
+                if self._is_bigram(term):
+                    for char in set(term):
+                        bigrams = self._bigrams[char]
+                        del bigrams[term]
+                        if not bigrams:
+                            del self._bigrams[char]
+
+    def update(self, message_id: int, text: str):
+        """消息内容变化后重新索引"""
+        self.remove(message_id)
+        self.add(message_id, text)
+
+    def search(self, query: str, page: int = 1, page_size: int = SEARCH_PAGE_SIZE):
+        """搜索包含查询中所有词的消息
+
+        返回 (匹配总数, 当前页的 message_id 列表)，相关度高的在前，相同时新消息在前
+        """
+        terms = set(tokenize(query))
+        if not terms or page < 1:
+            return 0, []
+        postings = []
+        for term in terms:
+            matches = self._lookup(term)
+            if not matches:
+                return 0, []
+            postings.append((term, matches))
+        postings.sort(key=lambda item: len(item[1]))
+
+        candidates = set(postings[0][1])
+        for _, matches in postings[1:]:
+            candidates.intersection_update(matches)
+            if not candidates:
+                return 0, []
+
+        total_docs = len(self._documents)
+        weights = [(matches, math.log(1 + total_docs / len(matches))) for _, matches in postings]
+        scored = []
+        for message_id in candidates:
+            score = sum(matches[message_id] * idf for matches, idf in weights)
+            # 长消息里偶然出现的词权重低一些
+            score /= math.sqrt(sum(self._documents[message_id].values()))
+            scored.append((score, message_id))
+
+        top = heapq.nlargest(page * page_size, scored)
+        return len(candidates), [message_id for _, message_id in top[(page - 1) * page_size:]]
+
+    def _lookup(self, term: str) -> dict:
+        """查找词的倒排表；单个汉字查询时合并所有包含它的二元组"""
+        matches = self._postings.get(term)
+        if len(term) != 1 or not _CJK_CHAR_RE.match(term):
+            return matches
+        merged = dict(matches or {})
+        for bigram in self._bigrams.get(term, ()):
+            for message_id, count in self._postings[bigram].items():
+                merged[message_id] = merged.get(message_id, 0) + count
+        return merged
+
+    def __len__(self) -> int:
+        return len(self._documents)
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from config import DB_PATH, STORAGE_FLUSH_INTERVAL, STORAGE_BATCH_SIZE, STORAGE_RETRY_MAX_DELAY
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(obj):
+    """JSON 不支持的类型：datetime 和 set"""
+    if isinstance(obj, datetime):
+        return {'$dt': obj.isoformat()}
+    if isinstance(obj, (set, frozenset)):
+        return {'$set': list(obj)}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if '$dt' in obj:
+            return datetime.fromisoformat(obj['$dt'])
+        if '$set' in obj:
+            return set(obj['$set'])
+    return obj
+
+
+def dumps(data) -> str:
+    return json.dumps(data, default=_encode, ensure_ascii=False)
+
+
+def loads(text: str):
+    return json.loads(text, object_hook=_decode)
+
+
+class StorageBackend:
+    """存储后端接口（聊天室状态、用户数据和待发送消息，聊天记录由 MessageLog 保存）
+
+    写操作以 (操作名, 参数) 的形式批量交给 apply_batch，
+    新的后端只需实现 apply_batch 和几个 load_* 方法。
+    """
+
+    def save_room(self, room_id: str, state: dict):
+        self.apply_batch([('save_room', (room_id, state))])
+
+    def delete_room(self, room_id: str):
+        self.apply_batch([('delete_room', (room_id,))])
+
+    def save_user(self, user_id: int, state: dict):
+        self.apply_batch([('save_user', (user_id, state))])
+
+    def save_outbox_job(self, job_id: str, state: dict):
+        self.apply_batch([('save_outbox_job', (job_id, state))])
+
+    def delete_outbox_job(self, job_id: str):
+        self.apply_batch([('delete_outbox_job', (job_id,))])
+
+    def apply_batch(self, ops: list):
+        raise NotImplementedError
+
+    def load_rooms(self) -> list:
+        raise NotImplementedError
+
+    def load_users(self) -> dict:
+        raise NotImplementedError
+
+    def load_outbox(self) -> list:
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(StorageBackend):
+    """SQLite 存储后端（WAL 模式）"""
+
+    def __init__(self, path: str = DB_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS rooms (
+                    room_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS outbox (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL UNIQUE,
+                    data TEXT NOT NULL
+                );
+            """)
+            self._conn.commit()
+
+    def apply_batch(self, ops: list):
+        with self._lock, self._conn:
+            for op, args in ops:
+                if op == 'save_room':
+                    room_id, state = args
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO rooms (room_id, data) VALUES (?, ?)",
+                        (room_id, dumps(state)))
+                elif op == 'delete_room':
+                    self._conn.execute("DELETE FROM rooms WHERE room_id = ?", args)
+                elif op == 'save_user':
+                    user_id, state = args
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+                        (user_id, dumps(state)))
+                elif op == 'save_outbox_job':
+                    job_id, state = args
+                    # 更新时保留原来的顺序
+                    self._conn.execute(
+                        "INSERT INTO outbox (job_id, data) VALUES (?, ?) "
+                        "ON CONFLICT(job_id) DO UPDATE SET data = excluded.data",
+                        (job_id, dumps(state)))
+                elif op == 'delete_outbox_job':
+                    self._conn.execute("DELETE FROM outbox WHERE job_id = ?", args)
+                else:
+                    raise ValueError(f"Unknown storage operation: {op}")
+
+    def load_rooms(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM rooms").fetchall()
+        return [loads(data) for data, in rows]
+
+    def load_users(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, data FROM users").fetchall()
+        return {user_id: loads(data) for user_id, data in rows}
+
+    def load_outbox(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM outbox ORDER BY seq").fetchall()
+        return [loads(data) for data, in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WriteBehindStorage(StorageBackend):
+    """后台批量写入的存储包装
+
+    写操作只进入内存队列，由后台线程每隔 flush_interval 秒
+    或积累 batch_size 条后一次性提交，消息热路径不会等待磁盘同步。
+    提交失败（数据库被锁、磁盘写满等）时这批操作放回队列开头，按指数退避重试，不会丢失。
+    """
+
+    def __init__(self, backend: StorageBackend,
+                 flush_interval: float = STORAGE_FLUSH_INTERVAL,
+                 batch_size: int = STORAGE_BATCH_SIZE):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()  # close() 时设置，打断重试前的等待
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='storage-writer', daemon=True)
+        self._thread.start()
+
+    def apply_batch(self, ops: list):
+        with self._lock:
+            self._pending.extend(ops)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+    def _run(self):
+        failures = 0
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                failures += 1
+                delay = min(STORAGE_RETRY_MAX_DELAY, self.flush_interval * 2 ** failures)
+                logger.error(f"Failed to flush storage, retrying in {delay:.0f}s: {e}")
+                self._stopped.wait(delay)
+            else:
+                failures = 0
+
+    def flush(self):
+        """把队列中的写操作提交到后端，失败时放回队列开头并抛出异常"""
+        with self._flush_lock:
+            with self._lock:
+                ops, self._pending = self._pending, []
+            if not ops:
+                return
+            try:
+                self.backend.apply_batch(ops)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = ops
+                raise
+
+    def load_rooms(self) -> list:
+        self.flush()
+        return self.backend.load_rooms()
+
+    def load_users(self) -> dict:
+        self.flush()
+        return self.backend.load_users()
+
+    def load_outbox(self) -> list:
+        self.flush()
+        return self.backend.load_outbox()
+
+    def close(self):
+        self._closed = True
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        self.backend.close()
+
+
+def create_storage(path: str = DB_PATH) -> StorageBackend:
+    """创建默认存储：SQLite + 后台批量写入"""
+    return WriteBehindStorage(SQLiteStorage(path))
@@ -0,0 +1,64 @@
+import time
+import pytest
+from auto_reply import AutoReplyMatcher, compile_regex, MATCH_WORD, MATCH_REGEX
+from config import AUTO_REPLY_REGEX_MAX_LENGTH
+
+
+def test_earliest_match_wins_over_rule_order():
+    matcher = AutoReplyMatcher({'world': {}, 'hello': {}})
+    assert matcher.match('hello world') == 'hello'
+
+
+def test_same_position_falls_back_to_rule_order():
+    matcher = AutoReplyMatcher({'hello': {}, 'hell': {}})
+    assert matcher.match('hello there') == 'hello'
+    matcher = AutoReplyMatcher({'hell': {}, 'hello': {}})
+    assert matcher.match('hello there') == 'hell'
+
+
+def test_regex_competes_by_position():
+    matcher = AutoReplyMatcher({'price': {}, r'\d+ yuan': {'match_type': MATCH_REGEX}})
+    assert matcher.match('10 yuan is the price') == r'\d+ yuan'
+    assert matcher.match('price: 10 yuan') == 'price'
+
+
+def test_whole_word_and_case():
+    matcher = AutoReplyMatcher({'hi': {'match_type': MATCH_WORD}})
+    assert matcher.match('HI there') == 'hi'
+    assert matcher.match('this') is None
+
+
+def test_no_match():
+    assert AutoReplyMatcher({'hello': {}}).match('goodbye') is None
+
+
+@pytest.mark.parametrize('pattern', [r'(a+)+$', r'(a|aa)*b', r'(\w+\s?)*$', r'(a)\1'])
+def test_compile_regex_rejects_backtracking_patterns(pattern):
+    with pytest.raises(ValueError):
+        compile_regex(pattern)
+
+
+@pytest.mark.parametrize('pattern', [r'a*a*a*a*b', r'a*a*b', r'.*x.*y', r'\w+@\w+\.com'])
+def test_compile_regex_rejects_polynomial_patterns(pattern):
+    with pytest.raises(ValueError):
+        compile_regex(pattern)
+
+
+def test_allowed_regex_is_fast_on_adversarial_input():
+    matcher = AutoReplyMatcher({r'a*a?b': {'match_type': MATCH_REGEX}, r'\d+\s?yuan': {'match_type': MATCH_REGEX}})
+    started = time.monotonic()
+    assert matcher.match('a' * 50000) is None
+    assert matcher.match('9' * 50000) is None
+    assert time.monotonic() - started < 1
+
+
+def test_compile_regex_rejects_long_patterns():
+    with pytest.raises(ValueError):
+        compile_regex('a' * (AUTO_REPLY_REGEX_MAX_LENGTH + 1))
+
+
+def test_invalid_regex_rule_is_skipped():
+    matcher = AutoReplyMatcher({'(a+)+': {'match_type': MATCH_REGEX}, 'aaa': {}})
+    started = time.monotonic()
+    assert matcher.match('a' * 50000 + '!') == 'aaa'
+    assert time.monotonic() - started < 1
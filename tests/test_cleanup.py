@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from chat_room import ChatRoom
+from cleanup import RoomCleaner
+from membership import MembershipIndex
+from user_manager import UserManager
+
+
+def _cleaner(monkeypatch, tmp_path):
+    chat_rooms = {}
+    membership = MembershipIndex()
+    cleaner = RoomCleaner(chat_rooms, UserManager(membership_index=membership), media_dir=str(tmp_path))
+    monkeypatch.setattr(ChatRoom, 'expiry_hooks', [cleaner.track])
+    return chat_rooms, membership, cleaner
+
+
+def test_rooms_created_at_runtime_expire(monkeypatch, tmp_path):
+    chat_rooms, membership, cleaner = _cleaner(monkeypatch, tmp_path)
+    room = chat_rooms['room'] = ChatRoom('room', 1, membership_index=membership)
+
+    assert cleaner.sweep()['rooms'] == 0
+    assert cleaner.sweep(datetime.now() + timedelta(hours=25))['rooms'] == 1
+    assert 'room' not in chat_rooms
+    assert not room.is_active
+
+
+def test_shortened_expiry_is_honoured(monkeypatch, tmp_path):
+    chat_rooms, membership, cleaner = _cleaner(monkeypatch, tmp_path)
+    chat_rooms['room'] = ChatRoom('room', 1, membership_index=membership)
+    chat_rooms['room'].extend_expire_time(1)
+
+    assert cleaner.sweep(datetime.now() + timedelta(hours=2))['rooms'] == 1
+
+
+def test_extended_expiry_is_honoured(monkeypatch, tmp_path):
+    chat_rooms, membership, cleaner = _cleaner(monkeypatch, tmp_path)
+    chat_rooms['room'] = ChatRoom('room', 1, membership_index=membership)
+    chat_rooms['room'].extend_expire_time(48)
+
+    assert cleaner.sweep(datetime.now() + timedelta(hours=25))['rooms'] == 0
+    assert cleaner.sweep(datetime.now() + timedelta(hours=49))['rooms'] == 1
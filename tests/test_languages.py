@@ -0,0 +1,22 @@
+import pytest
+from languages import Catalog, Template
+
+
+def test_template_renders_only_with_kwargs():
+    static = Template('braces {{kept}}')
+    templated = Template('hello {name} {{kept}}')
+    assert static.render({}) == 'braces {{kept}}'
+    assert templated.render({}) == 'hello {name} {{kept}}'
+    assert static.render({'name': 'x'}) == 'braces {kept}'
+    assert templated.render({'name': 'x'}) == 'hello x {kept}'
+
+
+def test_missing_placeholder_with_kwargs_raises():
+    with pytest.raises(KeyError):
+        Template('hello {name}').render({'other': 1})
+
+
+def test_catalog_falls_back_to_default_language(tmp_path):
+    catalog = Catalog({'zh': {'greet': '你好 {name}'}, 'en': {}}, default='zh',
+                      locales_dir=str(tmp_path))
+    assert catalog.get('greet', 'en', name='a') == '你好 a'
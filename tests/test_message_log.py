@@ -0,0 +1,93 @@
+import os
+import pytest
+from message_log import MessageLog
+
+
+def _message(message_id: int, content: str) -> dict:
+    return {'message_id': message_id, 'user_id': 1, 'type': 'text', 'content': content}
+
+
+def test_replay_restores_latest_versions(tmp_path):
+    log = MessageLog('room', base_dir=str(tmp_path))
+    log.write(_message(1, 'hello'))
+    log.write(_message(2, 'world'))
+    log.write(_message(1, 'hello again'))
+    log.write(_message(3, 'bye'))
+    log.remove(2)
+    log.close()
+
+    log = MessageLog('room', base_dir=str(tmp_path))
+    assert log.message_ids() == [1, 3]
+    assert log.read(1)['content'] == 'hello again'
+    assert log.read(2) is None
+    assert 2 not in log
+    log.close()
+
+
+def test_replay_across_segments(tmp_path):
+    log = MessageLog('room', base_dir=str(tmp_path), segment_size=100)
+    for message_id in range(1, 11):
+        log.write(_message(message_id, f"message {message_id}"))
+    log.close()
+    assert len(os.listdir(log.directory)) > 1
+
+    log = MessageLog('room', base_dir=str(tmp_path), segment_size=100)
+    assert log.message_ids() == list(range(1, 11))
+    assert log.recent_ids(2) == [10, 9]
+    assert log.read(5)['content'] == 'message 5'
+    log.close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    log = MessageLog('room', base_dir=str(tmp_path))
+    log.write(_message(1, 'complete'))
+    path = log._segment_path(0)
+    log.close()
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b'{"message_id": 2, "content": "tor')
+
+    log = MessageLog('room', base_dir=str(tmp_path))
+    assert log.message_ids() == [1]
+    assert os.path.getsize(path) == size
+
+    # 截掉残行后继续追加，新记录仍从完整的行开始
+    log.write(_message(2, 'after crash'))
+    log.close()
+    log = MessageLog('room', base_dir=str(tmp_path))
+    assert log.message_ids() == [1, 2]
+    assert log.read(2)['content'] == 'after crash'
+    log.close()
+
+
+def test_corrupt_line_is_skipped(tmp_path):
+    log = MessageLog('room', base_dir=str(tmp_path))
+    log.write(_message(1, 'first'))
+    path = log._segment_path(0)
+    log.close()
+    with open(path, 'ab') as f:
+        f.write(b'not json\n')
+    log = MessageLog('room', base_dir=str(tmp_path))
+    log.write(_message(2, 'second'))
+    log.close()
+
+    log = MessageLog('room', base_dir=str(tmp_path))
+    assert log.message_ids() == [1, 2]
+    assert log.read(2)['content'] == 'second'
+    log.close()
+
+
+def test_remove_files(tmp_path):
+    log = MessageLog('room', base_dir=str(tmp_path))
+    log.write(_message(1, 'hello'))
+    log.close()
+    MessageLog.remove_files('room', base_dir=str(tmp_path))
+    assert not os.path.exists(log.directory)
+
+
+def test_destroyed_log_rejects_writes(tmp_path):
+    log = MessageLog('room', base_dir=str(tmp_path))
+    log.write(_message(1, 'hello'))
+    log.destroy()
+    with pytest.raises(ValueError):
+        log.write(_message(2, 'too late'))
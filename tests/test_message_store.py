@@ -0,0 +1,36 @@
+from chat_room import ChatRoom
+from membership import MembershipIndex
+from message_log import MessageLog
+from message_store import MessageStore, MessageRecord
+from storage import SQLiteStorage
+
+
+def test_revoked_ids_are_not_reused_after_restart(tmp_path):
+    store = MessageStore(MessageLog('room', base_dir=str(tmp_path)))
+    for _ in range(10):
+        store.append(MessageRecord(store.next_id(), 1, 'text', 'hello'))
+    store.remove(9)
+    store.remove(10)
+    store.log.close()
+
+    log = MessageLog('room', base_dir=str(tmp_path))
+    assert log.last_id == 10
+    assert MessageStore(log).next_id() == 11
+    log.close()
+
+
+def test_chat_room_keeps_ids_after_reload(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    storage = SQLiteStorage(str(tmp_path / 'bot.db'))
+    room = ChatRoom('room', 1, storage, MembershipIndex())
+    for _ in range(10):
+        room.add_message(1, 'text', 'hello')
+    room.revoke_message(9)
+    room.revoke_message(10)
+    room.messages.log.close()
+
+    state, = storage.load_rooms()
+    room = ChatRoom.from_state(state, storage, MembershipIndex())
+    assert room.add_message(1, 'text', 'again').message_id == 11
+    room.messages.log.close()
+    storage.close()
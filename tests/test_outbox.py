@@ -0,0 +1,126 @@
+import asyncio
+from telegram.error import RetryAfter, Forbidden
+from config import MAX_MESSAGE_LENGTH
+from fanout import TokenBucket
+from outbox import Outbox
+
+
+class FakeBot:
+    """记录调用的假 Bot，errors 中的异常按顺序抛出"""
+
+    def __init__(self, errors=()):
+        self.calls = []
+        self.errors = list(errors)
+
+    async def send_message(self, chat_id, **kwargs):
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        self.calls.append((chat_id, kwargs))
+
+
+def _outbox(bot) -> Outbox:
+    outbox = Outbox(rate_limiter=TokenBucket(1000))
+    outbox.bot = bot
+    return outbox
+
+
+def test_merge_joins_consecutive_batched_texts():
+    async def run():
+        bot = FakeBot()
+        outbox = _outbox(bot)
+        for text in ('a', 'b', 'c'):
+            outbox.enqueue(1, 'send_message', batch=True, text=text)
+        outbox.enqueue(1, 'send_message', text='d')
+        outbox.enqueue(1, 'send_message', batch=True, text='e')
+        assert await outbox._drain(1) == 0
+        return bot.calls
+
+    calls = asyncio.run(run())
+    assert [kwargs['text'] for _, kwargs in calls] == ['a\nb\nc', 'd', 'e']
+
+
+def test_merge_stops_at_different_arguments_and_max_length():
+    async def run():
+        outbox = _outbox(FakeBot())
+        outbox.enqueue(1, 'send_message', batch=True, text='a', parse_mode='HTML')
+        outbox.enqueue(1, 'send_message', batch=True, text='b')
+        first = Outbox._merge(outbox._queues[1])
+
+        outbox = _outbox(FakeBot())
+        half = 'x' * (MAX_MESSAGE_LENGTH // 2)
+        for _ in range(3):
+            outbox.enqueue(1, 'send_message', batch=True, text=half)
+        second = Outbox._merge(outbox._queues[1])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == (1, {'text': 'a', 'parse_mode': 'HTML'})
+    assert second[0] == 1
+
+
+def test_merge_keeps_rooms_apart():
+    async def run():
+        outbox = _outbox(FakeBot())
+        outbox.enqueue(1, 'send_message', room_id='a', batch=True, text='from a')
+        outbox.enqueue(1, 'send_message', room_id='b', batch=True, text='from b')
+        return Outbox._merge(outbox._queues[1])
+
+    assert asyncio.run(run()) == (1, {'text': 'from a'})
+
+
+def test_cancel_keeps_job_being_sent():
+    async def run():
+        outbox = _outbox(FakeBot())
+        for text in ('a', 'b', 'c'):
+            outbox.enqueue(1, 'send_message', text=text)
+        outbox._sending[1] = 1
+        cancelled = outbox.cancel(1)
+        return cancelled, [job.kwargs['text'] for job in outbox._queues[1]]
+
+    assert asyncio.run(run()) == (2, ['a'])
+
+
+def test_cancel_from_sender():
+    async def run():
+        outbox = _outbox(FakeBot())
+        for chat_id in (1, 2):
+            outbox.enqueue(chat_id, 'send_message', sender_id=7, text='spam')
+            outbox.enqueue(chat_id, 'send_message', sender_id=8, text='hello')
+        cancelled = outbox.cancel_from(7)
+        return cancelled, {chat_id: [job.sender_id for job in queue]
+                           for chat_id, queue in outbox._queues.items()}
+
+    assert asyncio.run(run()) == (2, {1: [8], 2: [8]})
+
+
+def test_retry_after_pauses_every_recipient():
+    async def run():
+        bot = FakeBot([RetryAfter(5)])
+        outbox = _outbox(bot)
+        outbox.enqueue(1, 'send_message', text='a')
+        outbox.enqueue(2, 'send_message', text='b')
+        first = await outbox._drain(1)
+        second = await outbox._drain(2)
+        return bot, outbox, first, second
+
+    bot, outbox, first, second = asyncio.run(run())
+    assert first == 5.0
+    assert 0 < second <= 5.0
+    assert bot.calls == []
+    assert outbox.pending(1) == 1 and outbox.pending(2) == 1
+
+
+def test_permanent_error_drops_only_that_job():
+    async def run():
+        bot = FakeBot([Forbidden('blocked'), None])
+        outbox = _outbox(bot)
+        outbox.enqueue(1, 'send_message', text='a')
+        outbox.enqueue(1, 'send_message', text='b')
+        await outbox._drain(1)
+        return bot.calls, outbox.pending(1)
+
+    calls, pending = asyncio.run(run())
+    assert calls == [(1, {'text': 'b'})]
+    assert pending == 0
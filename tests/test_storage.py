@@ -0,0 +1,27 @@
+import pytest
+from storage import SQLiteStorage, WriteBehindStorage
+
+
+class FlakyStorage(SQLiteStorage):
+    """前 failures 次提交失败的 SQLite 存储"""
+
+    def __init__(self, path: str, failures: int):
+        super().__init__(path)
+        self.failures = failures
+
+    def apply_batch(self, ops: list):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('disk full')
+        super().apply_batch(ops)
+
+
+def test_failed_flush_keeps_pending_writes(tmp_path):
+    storage = WriteBehindStorage(FlakyStorage(str(tmp_path / 'bot.db'), 1), flush_interval=60)
+    storage.save_room('first', {'room_id': 'first'})
+    with pytest.raises(OSError):
+        storage.flush()
+    storage.save_room('second', {'room_id': 'second'})
+
+    assert [state['room_id'] for state in storage.load_rooms()] == ['first', 'second']
+    storage.close()
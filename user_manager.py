@@ -1,43 +1,106 @@
 from datetime import datetime
 from typing import Dict, Set
+from config import MAX_ROOMS_PER_USER
 from languages import DEFAULT_LANGUAGE
+from membership import membership, MembershipIndex
 
 class UserManager:
-    def __init__(self):
-        self.user_rooms: Dict[int, Set[str]] = {}  # 用户ID -> 房间ID集合
+    def __init__(self, storage=None, membership_index: MembershipIndex = None):
+        self.membership = membership_index or membership  # 用户和房间的双向索引，与 ChatRoom 共享
+        self.created_rooms: Dict[int, Set[str]] = {}  # 用户ID -> 创建的房间ID集合
+        self.room_creators: Dict[str, int] = {}  # 房间ID -> 创建者ID
         self.banned_users: Set[int] = set()  # 被封禁的用户ID
         self.admin_users: Set[int] = {12345}  # 管理员用户ID，初始添加一个管理员
         self.user_settings = {}  # 用户设置
+        self.storage = storage  # 持久化存储后端
 
-    def add_room_to_user(self, user_id: int, room_id: str) -> bool:
-        """为用户添加聊天室"""
+    def load(self, storage):
+        """从存储后端恢复用户数据，并在之后的修改中写回"""
+        for user_id, state in storage.load_users().items():
+            for room_id in state['rooms']:
+                self.membership.add(user_id, room_id)
+            for room_id in state.get('created', ()):
+                self._add_created(user_id, room_id)
+            if state['banned']:
+                self.banned_users.add(user_id)
+            if state['admin']:
+                self.admin_users.add(user_id)
+            if state['settings']:
+                self.user_settings[user_id] = state['settings']
+        self.storage = storage
+
+    def _save_user(self, user_id: int):
+        """保存单个用户的数据"""
+        if self.storage is None:
+            return
+        self.storage.save_user(user_id, {
+            'rooms': set(self.membership.rooms_of(user_id)),
+            'created': set(self.created_rooms.get(user_id, ())),
+            'banned': user_id in self.banned_users,
+            'admin': user_id in self.admin_users,
+            'settings': dict(self.user_settings.get(user_id, {}))
+        })
+
+    def _add_created(self, user_id: int, room_id: str):
+        self.created_rooms.setdefault(user_id, set()).add(room_id)
+        self.room_creators[room_id] = user_id
+
+    def add_room_to_user(self, user_id: int, room) -> bool:
+        """让用户加入聊天室（经过聊天室的黑名单和人数检查），创建者加入时计入创建数量"""
         if user_id in self.banned_users:
             return False
-        
-        if user_id not in self.user_rooms:
-            self.user_rooms[user_id] = set()
-            
-        self.user_rooms[user_id].add(room_id)
+        if user_id not in room.users:
+            if not room.can_join(user_id):
+                return False
+            room.add_user(user_id)
+        if user_id == room.creator_id:
+            self._add_created(user_id, room.room_id)
+        self._save_user(user_id)
         return True
 
-    def remove_room_from_user(self, user_id: int, room_id: str):
-        """从用户移除聊天室"""
-        if user_id in self.user_rooms:
-            self.user_rooms[user_id].discard(room_id)
+    def remove_room_from_user(self, user_id: int, room):
+        """让用户离开聊天室"""
+        if user_id in room.users:
+            room.remove_user(user_id)
+            self._save_user(user_id)
+
+    def remove_room(self, room_id: str) -> set:
+        """聊天室关闭后从所有成员和创建者的记录中移除，返回受影响的用户"""
+        users = self.membership.remove_room(room_id)
+        creator_id = self.room_creators.pop(room_id, None)
+        if creator_id is not None:
+            created = self.created_rooms[creator_id]
+            created.discard(room_id)
+            if not created:
+                del self.created_rooms[creator_id]
+            users.add(creator_id)
+        for user_id in users:
+            self._save_user(user_id)
+        return users
+
+    def get_user_rooms(self, user_id: int):
+        """获取用户所在的所有聊天室"""
+        return self.membership.rooms_of(user_id)
+
+    def get_room_count(self) -> int:
+        """当前有成员的聊天室总数"""
+        return self.membership.room_count()
 
     def can_create_room(self, user_id: int) -> bool:
         """检查用户是否可以创建新的聊天室"""
         if user_id in self.banned_users:
             return False
-        return len(self.user_rooms.get(user_id, set())) < MAX_ROOMS_PER_USER
+        return len(self.created_rooms.get(user_id, ())) < MAX_ROOMS_PER_USER
 
     def ban_user(self, user_id: int):
         """封禁用户"""
         self.banned_users.add(user_id)
+        self._save_user(user_id)
 
     def unban_user(self, user_id: int):
         """解封用户"""
         self.banned_users.discard(user_id)
+        self._save_user(user_id)
 
     def is_admin(self, user_id: int) -> bool:
         """检查用户是否是管理员"""
@@ -46,12 +109,14 @@ class UserManager:
     def add_admin(self, user_id: int):
         """添加管理员"""
         self.admin_users.add(user_id)
+        self._save_user(user_id)
 
     def set_language(self, user_id: int, language: str):
         """设置用户语言"""
         if user_id not in self.user_settings:
             self.user_settings[user_id] = {}
         self.user_settings[user_id]['language'] = language
+        self._save_user(user_id)
         
     def get_language(self, user_id: int) -> str:
         """获取用户语言设置"""
@@ -62,6 +127,7 @@ class UserManager:
         if user_id not in self.user_settings:
             self.user_settings[user_id] = {}
         self.user_settings[user_id]['welcome_message'] = message
+        self._save_user(user_id)
         
     def get_welcome_message(self, user_id: int) -> str:
         """获取用户自定义欢迎消息"""
@@ -0,0 +1,190 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+from telegram import Update
+from config import (
+    WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_SECRET_FILE, WEBHOOK_MAX_BODY, WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADERS = 64  # 最多接受的请求头数量
+READ_TIMEOUT = 10  # 读取请求的超时时间（秒）
+
+_REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 408: 'Request Timeout', 411: 'Length Required',
+    413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+    503: 'Service Unavailable'
+}
+
+
+class WebhookServer:
+    """接收 Telegram webhook 的轻量 HTTP 服务
+
+    只处理 POST WEBHOOK_PATH：校验 secret token（必须设置），按 Content-Length 读取有限大小的请求体，
+    解析后的 Update 放入有界队列，由固定数量的 worker 交给 application 处理。
+    队列满时返回 503，让 Telegram 稍后重试。
+    """
+
+    def __init__(self, application, secret_token: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH,
+                 max_body: int = WEBHOOK_MAX_BODY, queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 workers: int = WEBHOOK_WORKERS):
+        if not secret_token:
+            raise ValueError("Webhook secret token is required")
+        self.application = application
+        self.secret_token = secret_token
+        self.path = path
+        self.max_body = max_body
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self._server = None
+        self._tasks = []
+
+    async def start(self, host: str, port: int):
+        """开始监听"""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+
+    async def stop(self):
+        """停止监听，并处理完队列中剩余的 Update"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            data = await self.queue.get()
+            try:
+                update = Update.de_json(data, self.application.bot)
+                await self.application.process_update(update)
+            except Exception as e:
+                logger.error(f"Failed to process webhook update: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _read_request(self, reader):
+        """读取请求，返回 (状态码, 解析后的 JSON)"""
+        request_line = await reader.readline()
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            return 400, None
+        method, path, _ = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                return 431, None
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if path != self.path:
+            return 404, None
+        if method != 'POST':
+            return 405, None
+        if not hmac.compare_digest(
+                headers.get('x-telegram-bot-api-secret-token', ''), self.secret_token):
+            return 403, None
+        try:
+            length = int(headers['content-length'])
+        except (KeyError, ValueError):
+            return 411, None
+        if length < 0 or length > self.max_body:
+            return 413, None
+
+        body = await reader.readexactly(length)
+        try:
+            return 200, json.loads(body)
+        except ValueError:
+            return 400, None
+
+    async def _handle_connection(self, reader, writer):
+        extra_headers = ''
+        try:
+            status, data = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            status, data = 408, None
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            status, data = 400, None
+
+        if status == 200:
+            try:
+                self.queue.put_nowait(data)
+            except asyncio.QueueFull:
+                logger.warning("Webhook queue is full, asking Telegram to retry")
+                status = 503
+                extra_headers = 'Retry-After: 1\r\n'
+
+        try:
+            writer.write((f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                          f"Content-Length: 0\r\n{extra_headers}"
+                          f"Connection: close\r\n\r\n").encode('latin-1'))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(application, listen: str, port: int, url: str, secret_token: str):
+    server = WebhookServer(application, secret_token)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await server.start(listen, port)
+    await application.bot.set_webhook(url=url, secret_token=secret_token,
+                                      drop_pending_updates=True)
+    await application.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+
+def _write_secret(secret_token: str, path: str = WEBHOOK_SECRET_FILE):
+    """把随机生成的 secret token 写入只有自己可读的文件"""
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secret_token)
+    except OSError as e:
+        logger.warning(f"Failed to write webhook secret to {path}: {e}")
+
+
+def run_webhook(application, listen: str, port: int, url: str, secret_token: str = WEBHOOK_SECRET):
+    """以 webhook 模式运行，直到收到停止信号
+
+    没有配置 secret token 时每次启动随机生成一个，通过 set_webhook 告诉 Telegram，
+    并写入 WEBHOOK_SECRET_FILE 供 webhook_replay.py 使用。不接受没有 secret token 的请求。
+    """
+    if not secret_token:
+        secret_token = secrets.token_urlsafe(32)
+        _write_secret(secret_token)
+        logger.info(f"WEBHOOK_SECRET is not set, using a random secret token saved in {WEBHOOK_SECRET_FILE}")
+    asyncio.run(_serve(application, listen, port, url, secret_token))
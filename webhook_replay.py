@@ -0,0 +1,63 @@
+"""把录制的 Update JSON 发送到本地 webhook，用于测试 webhook 模式
+
+每行一个 Update JSON：
+
+    python webhook_replay.py updates.jsonl [http://127.0.0.1:8443/webhook] [--secret TOKEN]
+
+secret token 依次取 --secret、环境变量 WEBHOOK_SECRET、config.WEBHOOK_SECRET，
+都没有设置时读取 bot 启动时随机生成并写入 WEBHOOK_SECRET_FILE 的 token。
+"""
+import argparse
+import os
+import urllib.error
+import urllib.request
+from config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_SECRET_FILE
+
+
+def default_secret() -> str:
+    """找出运行中的 bot 使用的 secret token"""
+    secret_token = os.environ.get('WEBHOOK_SECRET') or WEBHOOK_SECRET
+    if secret_token:
+        return secret_token
+    try:
+        with open(WEBHOOK_SECRET_FILE, encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ''
+
+
+def post_update(url: str, body: bytes, secret_token: str = None) -> int:
+    """发送一个 Update，返回 HTTP 状态码"""
+    if secret_token is None:
+        secret_token = default_secret()
+    request = urllib.request.Request(url, data=body, method='POST')
+    request.add_header('Content-Type', 'application/json')
+    if secret_token:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret_token)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把录制的 Update JSON 发送到本地 webhook")
+    parser.add_argument('updates', help="每行一个 Update JSON 的文件")
+    parser.add_argument('url', nargs='?', default=f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument('--secret', default=None, help="webhook 的 secret token")
+    args = parser.parse_args()
+    secret_token = args.secret if args.secret is not None else default_secret()
+    statuses = {}
+    with open(args.updates, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            status = post_update(args.url, line, secret_token)
+            statuses[status] = statuses.get(status, 0) + 1
+    print(statuses)
+
+
+if __name__ == '__main__':
+    main()